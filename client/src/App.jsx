@@ -6,6 +6,7 @@ import { Login } from './Login';
 import { ActionBar } from './ActionBar';
 import { PlayerActions } from './PlayerActions';
 import { DisconnectedOverlay } from './DisconnectedOverlay';
+import { decodeBinaryFrame } from './binaryProtocol';
 import './Chat.css';
 import './Login.css';
 import './ActionBar.css';
@@ -13,6 +14,9 @@ import './PlayerActions.css';
 import './Disconnected.css';
 
 const MAX_RECONNECT_ATTEMPTS = 3;
+const PROTOCOL_VERSION = 2; // 2 = one tick_delta frame per server tick instead of a message per event
+const WIRE_ENCODING = 'binary'; // tick_delta frames as compact binary (see binaryProtocol.js); the server falls back to JSON
+const WORLD_SYNC = 'chunked'; // Stream the world as map chunks and entity pages instead of one world_state
 
 function App() {
   console.log('[APP] App component initializing...');
@@ -56,6 +60,7 @@ function App() {
     console.log(`[CLIENT] Attempting to connect to ${wsUrl}...`);
     
     ws.current = new WebSocket(wsUrl);
+    ws.current.binaryType = 'arraybuffer';
 
     ws.current.onopen = () => {
       console.log('[CLIENT] WebSocket connection opened.');
@@ -68,7 +73,7 @@ function App() {
         setTimeout(() => {
           if (ws.current && ws.current.readyState === WebSocket.OPEN && isMounted.current) {
             console.log('[CLIENT] Sending join request...');
-            ws.current.send(JSON.stringify({ type: 'player_join_request', name: playerName }));
+            ws.current.send(JSON.stringify({ type: 'player_join_request', name: playerName, protocol: PROTOCOL_VERSION, encoding: WIRE_ENCODING, sync: WORLD_SYNC }));
           }
         }, 50);
       }
@@ -78,7 +83,7 @@ function App() {
     ws.current.onmessage = (event) => {
         if (!isMounted.current) return;
         
-        const message = JSON.parse(event.data);
+        const message = event.data instanceof ArrayBuffer ? decodeBinaryFrame(event.data) : JSON.parse(event.data);
         console.log('[CLIENT] Received message:', message.type, message);
         
         if (message.type === 'join_success') {
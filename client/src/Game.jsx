@@ -14,6 +14,7 @@ class MainScene extends Phaser.Scene {
     this.lastMoveTime = 0;
     this.ws = null;
     this.messageQueue = [];
+    this.pendingWorld = null; // World being assembled from a chunked sync (world_begin ... world_end)
     this.selectedAction = 'till';
     
     // Zone configuration
@@ -328,6 +329,44 @@ class MainScene extends Phaser.Scene {
             this.rebuildWorld(message.world);
             break;
 
+        case 'world_begin':
+            console.log(`[GAME] Chunked world sync started (${message.reason}):`, message.entities);
+            this.pendingWorld = {
+              reason: message.reason,
+              player_id: message.player_id,
+              world: {
+                map: Array.from({ length: message.height }, () => new Array(message.width).fill(0)),
+                fauna: {}, food: {}, players: {}
+              }
+            };
+            break;
+
+        case 'map_chunk':
+            if (this.pendingWorld) {
+              const map = this.pendingWorld.world.map;
+              // rle is [tile, count, tile, count, ...] over the chunk's tiles, row by row
+              let i = 0;
+              for (let r = 0; r < message.rle.length; r += 2) {
+                for (let n = 0; n < message.rle[r + 1]; n++, i++) {
+                  map[message.y + Math.floor(i / message.w)][message.x + (i % message.w)] = message.rle[r];
+                }
+              }
+            }
+            break;
+
+        case 'world_entities':
+            if (this.pendingWorld) Object.assign(this.pendingWorld.world[message.kind], message.entities);
+            break;
+
+        case 'world_end':
+            if (this.pendingWorld) {
+              const { reason, player_id, world } = this.pendingWorld;
+              this.pendingWorld = null;
+              // Hand the assembled world to the existing handlers; the server holds everything else back until now
+              this.messageQueue.unshift(reason === 'reset' ? { type: 'world_reset', world } : { type: 'world_state', player_id, world });
+            }
+            break;
+
         case 'zone_refresh':
             console.log('[GAME] Received zone refresh response from server');
             this.myId = message.player_id;
@@ -419,6 +458,16 @@ class MainScene extends Phaser.Scene {
             }
             break;
             
+        case 'tick_delta':
+            // Unpack the frame into the per-event messages handled below, ahead of anything else queued
+            this.messageQueue.unshift(...this.expandTickDelta(message));
+            break;
+
+        case 'fauna_entered':
+            // Already alive, just newly in range: no spawn sound or spawn limit
+            if (!this.fauna[message.fauna_id]) this.fauna[message.fauna_id] = this.createEntity(message.fauna_id, message.data, 'dragon');
+            break;
+
         case 'fauna_moved':
             if (this.fauna[message.fauna_id]) {
                 const faunaSprite = this.fauna[message.fauna_id];
@@ -495,10 +544,35 @@ class MainScene extends Phaser.Scene {
             delete this.otherPlayers[message.player_id];
           }
           break;
+
+        case 'error':
+          if (message.reason === 'rate_limited') console.warn(`[GAME] Server rate limited ${message.message_type}; slow down`);
+          break;
       }
     }
   }
 
+  expandTickDelta(frame) {
+    const messages = [];
+    for (const id in frame.fauna_spawned || {}) messages.push({ type: 'fauna_spawned', fauna_id: id, data: frame.fauna_spawned[id] });
+    for (const id in frame.fauna_updated || {}) {
+      messages.push({ type: 'fauna_stage_changed', fauna_id: id, data: frame.fauna_updated[id] });
+      messages.push({ type: 'fauna_moved', fauna_id: id, data: frame.fauna_updated[id] });
+    }
+    for (const id in frame.fauna_moved || {}) messages.push({ type: 'fauna_moved', fauna_id: id, data: frame.fauna_moved[id] });
+    for (const id of frame.fauna_removed || []) messages.push({ type: 'fauna_removed', fauna_id: id });
+    for (const id in frame.food_spawned || {}) messages.push({ type: 'food_spawned', food_id: id, data: frame.food_spawned[id] });
+    for (const id of frame.food_removed || []) messages.push({ type: 'food_removed', food_id: id });
+    // Area of interest: entities that came into or went out of range of our player
+    for (const id in frame.fauna_entered || {}) messages.push({ type: 'fauna_entered', fauna_id: id, data: frame.fauna_entered[id] });
+    for (const id of frame.fauna_left || []) messages.push({ type: 'fauna_removed', fauna_id: id });
+    for (const id in frame.food_entered || {}) messages.push({ type: 'food_spawned', food_id: id, data: frame.food_entered[id] });
+    for (const id of frame.food_left || []) messages.push({ type: 'food_removed', food_id: id });
+    for (const id in frame.players_entered || {}) messages.push({ type: 'player_joined', player_id: id, data: frame.players_entered[id] });
+    for (const id of frame.players_left || []) messages.push({ type: 'player_left', player_id: id });
+    return messages;
+  }
+
   updateAttachedUI() {
     const updateElement = (sprite) => {
         if (!sprite) return;
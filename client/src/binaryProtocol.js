@@ -0,0 +1,86 @@
+// Decoder for the server's binary tick_delta frames (see BinaryFrameEncoder in server/protocol.py).
+// A decoded frame has the same shape as a JSON tick_delta, so Game.jsx handles both the same way.
+
+const FRAME_TICK_DELTA = 1;
+const POSITION_SCALE = 4;
+const FAUNA_KINDS = ['dragon'];
+const FAUNA_STAGES = ['Infant', 'Young', 'Adult', 'Elderly'];
+const FLAG_DEAD = 1;
+
+// section code -> [section name, entry layout]
+const SECTIONS = {
+  1: ['fauna_moved', 'position'],
+  2: ['fauna_updated', 'fauna'],
+  3: ['fauna_spawned', 'fauna'],
+  4: ['fauna_removed', 'id'],
+  5: ['food_spawned', 'position'],
+  6: ['food_removed', 'id'],
+  7: ['fauna_entered', 'fauna'],
+  8: ['fauna_left', 'id'],
+  9: ['food_entered', 'position'],
+  10: ['food_left', 'id'],
+  11: ['players_entered', 'player'],
+  12: ['players_left', 'id'],
+};
+
+const textDecoder = new TextDecoder();
+
+export function decodeBinaryFrame(buffer) {
+  const view = new DataView(buffer);
+  const bytes = new Uint8Array(buffer);
+  let offset = 0;
+
+  const readString = () => {
+    const length = view.getUint8(offset);
+    const value = textDecoder.decode(bytes.subarray(offset + 1, offset + 1 + length));
+    offset += 1 + length;
+    return value;
+  };
+  const readPosition = () => {
+    const x = view.getInt16(offset, true) / POSITION_SCALE;
+    const y = view.getInt16(offset + 2, true) / POSITION_SCALE;
+    offset += 4;
+    return { x, y };
+  };
+
+  const frameType = view.getUint8(0);
+  if (frameType !== FRAME_TICK_DELTA) throw new Error(`Unknown binary frame type ${frameType}`);
+  const frame = { type: 'tick_delta', tick: view.getUint32(2, true) };
+  offset = 6;
+
+  while (offset < buffer.byteLength) {
+    const code = view.getUint8(offset);
+    const count = view.getUint16(offset + 1, true);
+    offset += 3;
+    const [name, layout] = SECTIONS[code];
+    if (layout === 'id') {
+      const ids = frame[name] || (frame[name] = []);
+      for (let i = 0; i < count; i++) ids.push(readString());
+      continue;
+    }
+    const entries = frame[name] || (frame[name] = {});
+    for (let i = 0; i < count; i++) {
+      const id = readString();
+      if (layout === 'fauna') {
+        const kind = view.getUint8(offset);
+        offset += 1;
+        const position = readPosition();
+        entries[id] = {
+          ...position,
+          kind: FAUNA_KINDS[kind] || 'dragon',
+          stage: FAUNA_STAGES[view.getUint8(offset)],
+          is_dead: (view.getUint8(offset + 1) & FLAG_DEAD) !== 0,
+          age_seconds: view.getFloat32(offset + 2, true),
+          offspring_count: view.getUint16(offset + 6, true),
+        };
+        offset += 8;
+      } else if (layout === 'player') {
+        const position = readPosition();
+        entries[id] = { ...position, name: readString() };
+      } else {
+        entries[id] = readPosition();
+      }
+    }
+  }
+  return frame;
+}
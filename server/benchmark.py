@@ -0,0 +1,660 @@
+"""
+Headless load test and benchmark harness. Results are JSON so runs can be diffed between commits.
+
+Run from server/:
+
+    python benchmark.py load --clients 50 --duration 30 --out load.json
+    python benchmark.py load --url ws://localhost:8000/ws --clients 200 --duration 60
+    python benchmark.py fauna --fauna 5000 --food 500 --ticks 20 --engine vector --out fauna.json
+    python benchmark.py engines --fauna 500 --ticks 10
+    python benchmark.py load --persistence journal --out journal.json
+    python benchmark.py replay --journal project_arbor_journal --out replay.json
+    python benchmark.py compare before.json after.json
+
+"load" runs main.py's app in this process (or talks to a running server with --url) and drives
+N synthetic clients that join, stream player_move, drop food and till tiles. "fauna" seeds a world
+through db.py and times FaunaManager.update_fauna on its own. Both use a throwaway database
+unless --db is given, so the real project_arbor.db is never touched. "engines" checks that the
+dict and vector fauna engines agree: both run the same seeded world with random rolls, the clock
+and new ids pinned, and every tick's delta frame plus the final fauna are diffed. "replay" times
+loading a journal directory (journal persistence mode): its latest snapshot plus every journaled tick.
+"""
+
+import os
+import sys
+import copy
+import json
+import uuid
+import time
+import math
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+import urllib.request
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+import db
+from fauna import ELDERLY_MIN_LIFESPAN, ELDERLY_MAX_LIFESPAN
+
+# --- Benchmark Defaults ---
+DEFAULT_CLIENTS = 20
+DEFAULT_DURATION = 20.0 # Seconds of load after every client has joined
+DEFAULT_MOVE_RATE = 10.0 # player_move messages per client per second (the client sends at most one per 100ms)
+DEFAULT_DROP_FOOD_RATE = 0.2 # Per client per second
+DEFAULT_TILL_RATE = 0.5
+DEFAULT_TICK_RATE = 0.5 # In-process runs tick faster than TICK_RATE so a short run still collects samples
+DEFAULT_SEED = 1
+WORLD_WIDTH, WORLD_HEIGHT = 800, 600
+
+
+# --- Results ---
+def summarize(samples: list) -> dict:
+    """count/mean/p50/p95/p99/max of a list of numbers, rounded for stable diffs."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(math.ceil(p / 100 * len(ordered))) - 1)]
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 3),
+        "p50": round(percentile(50), 3),
+        "p95": round(percentile(95), 3),
+        "p99": round(percentile(99), 3),
+        "max": round(ordered[-1], 3),
+    }
+
+
+def max_rss_kb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss # macOS reports bytes, Linux kilobytes
+
+
+def run_metadata() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "platform": platform.platform(), "started": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def write_results(results: dict, out):
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if out:
+        with open(out, "w") as f:
+            f.write(text + "\n")
+        print(f"Results written to {out}")
+    else:
+        print(text)
+
+
+# --- World Seeding ---
+def use_scratch_db(path=None) -> str:
+    """Points db.py at a benchmark database (a fresh temp file unless path is given)."""
+    db.DB_FILE = path or os.path.join(tempfile.mkdtemp(prefix="arbor-bench-"), "bench.db")
+    return db.DB_FILE
+
+
+def seed_world(fauna_count: int, food_count: int, rng: random.Random):
+    """Creates the default world through db.py, then adds fauna at every life stage plus food."""
+    db.init_db()
+    if not db.db_read("SELECT 1 FROM zone_map LIMIT 1"):
+        db.initialize_default_world()
+    stages = [("Young", 150), ("Adult", 400), ("Elderly", 1000)]
+    fauna_rows = []
+    for i in range(fauna_count):
+        stage, age = rng.choice(stages)
+        # Elderly fauna got a death timer when they aged into the stage
+        death_timer = time.time() + rng.randint(ELDERLY_MIN_LIFESPAN, ELDERLY_MAX_LIFESPAN) if stage == "Elderly" else None
+        fauna_rows.append((f"bench_dragon_{i}", "dragon", rng.uniform(16, 784), rng.uniform(16, 584), age, stage, False, 0, death_timer, None))
+    db.db_write_many("INSERT OR REPLACE INTO fauna (id, kind, x, y, age_seconds, stage, is_dead, offspring_count, death_timer, goal) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", fauna_rows)
+    db.db_write_many("INSERT OR REPLACE INTO food (id, x, y) VALUES (?, ?, ?)", [(f"bench_food_{i}", rng.uniform(16, 784), rng.uniform(16, 584)) for i in range(food_count)])
+    db.db_flush()
+
+
+# --- Synthetic Clients ---
+class InProcessSocket:
+    """Talks ASGI directly to the app, so clients and server share one event loop and no network."""
+
+    def __init__(self, app, path: str = "/ws"):
+        self.app = app
+        self.path = path
+        self._to_app = asyncio.Queue()
+        self._from_app = asyncio.Queue()
+        self.task = None
+
+    async def connect(self):
+        scope = {
+            "type": "websocket", "asgi": {"version": "3.0"}, "scheme": "ws", "path": self.path, "raw_path": self.path.encode(),
+            "root_path": "", "query_string": b"", "headers": [], "subprotocols": [], "client": ("bench", 0), "server": ("bench", 80),
+        }
+        self._to_app.put_nowait({"type": "websocket.connect"})
+        self.task = asyncio.create_task(self.app(scope, self._to_app.get, self._from_app.put))
+        accepted = await self._from_app.get()
+        if accepted["type"] != "websocket.accept":
+            raise ConnectionError(f"Server refused the websocket: {accepted}")
+
+    async def send(self, text: str):
+        self._to_app.put_nowait({"type": "websocket.receive", "text": text})
+
+    async def recv(self):
+        message = await self._from_app.get()
+        if message["type"] == "websocket.close":
+            raise ConnectionError(f"Server closed the websocket ({message.get('code')})")
+        return message.get("text") if message.get("text") is not None else message.get("bytes")
+
+    async def close(self):
+        self._to_app.put_nowait({"type": "websocket.disconnect", "code": 1000})
+        if self.task is not None:
+            await asyncio.wait([self.task], timeout=5)
+
+
+class RemoteSocket:
+    """The same interface over a real websocket, for benchmarking a server on localhost."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.connection = None
+
+    async def connect(self):
+        self.connection = await websockets.connect(self.url, max_size=None)
+
+    async def send(self, text: str):
+        await self.connection.send(text)
+
+    async def recv(self):
+        try:
+            return await self.connection.recv()
+        except websockets.ConnectionClosed as e:
+            raise ConnectionError(str(e))
+
+    async def close(self):
+        await self.connection.close()
+
+
+class LoadStats:
+    def __init__(self):
+        self.join_latency_ms = []
+        self.broadcast_latency_ms = []
+        self.sent_moves = {} # (player_id, x, y) -> when it was sent, matched against player_moved
+        self.messages_received = 0
+        self.bytes_received = 0
+        self.messages_sent = 0
+        self.errors = []
+
+
+class SyntheticClient:
+    def __init__(self, index: int, socket, stats: LoadStats, args, rng: random.Random):
+        self.name = f"bench_{index}"
+        self.socket = socket
+        self.stats = stats
+        self.args = args
+        self.rng = rng
+        self.player_id = None
+        self.x = rng.uniform(50, WORLD_WIDTH - 50)
+        self.y = rng.uniform(50, WORLD_HEIGHT - 50)
+        self.joined = asyncio.Event()
+
+    async def join(self):
+        started = time.perf_counter()
+        await self.socket.connect()
+        await self.socket.send(json.dumps({"type": "player_join_request", "name": self.name, "protocol": self.args.protocol, "encoding": self.args.encoding, "sync": self.args.sync}))
+        while not self.joined.is_set():
+            self._handle(await self.socket.recv())
+        self.stats.join_latency_ms.append((time.perf_counter() - started) * 1000)
+
+    async def receive_forever(self):
+        while True:
+            self._handle(await self.socket.recv())
+
+    def _handle(self, frame):
+        self.stats.messages_received += 1
+        self.stats.bytes_received += len(frame)
+        if isinstance(frame, bytes):
+            return # Binary tick_delta: counted, nothing to match
+        message = json.loads(frame)
+        kind = message.get("type")
+        if kind == "world_state" or (kind == "world_begin" and message.get("reason") == "join"):
+            self.player_id = message["player_id"]
+        if kind in ("world_state", "world_end"):
+            self.joined.set()
+        elif kind == "player_moved":
+            data = message["data"]
+            sent = self.stats.sent_moves.get((message["player_id"], data["x"], data["y"]))
+            if sent is not None:
+                self.stats.broadcast_latency_ms.append((time.perf_counter() - sent) * 1000)
+        elif kind == "error":
+            raise ConnectionError(f"{self.name} was refused: {message.get('reason')}")
+
+    async def act(self, until: float):
+        """Random-walks at the move rate, dropping food and tilling now and then."""
+        interval = 1.0 / self.args.move_rate
+        while time.perf_counter() < until:
+            await asyncio.sleep(interval * self.rng.uniform(0.8, 1.2))
+            self.x = min(WORLD_WIDTH - 16, max(16, self.x + self.rng.uniform(-12, 12)))
+            self.y = min(WORLD_HEIGHT - 16, max(16, self.y + self.rng.uniform(-12, 12)))
+            self.stats.sent_moves[(self.player_id, self.x, self.y)] = time.perf_counter()
+            await self._send({"type": "player_move", "x": self.x, "y": self.y})
+            if self.rng.random() < self.args.drop_food_rate * interval:
+                await self._send({"type": "action_drop_food", "pos": {"x": self.x, "y": self.y}})
+            if self.rng.random() < self.args.till_rate * interval:
+                await self._send({"type": "action_till", "tile": {"x": int(self.x // 16), "y": int(self.y // 16)}})
+
+    async def _send(self, message: dict):
+        await self.socket.send(json.dumps(message))
+        self.stats.messages_sent += 1
+
+
+async def _lifespan(app, event: str):
+    """Runs the app's startup or shutdown handlers the way an ASGI server would."""
+    if event == "startup":
+        app._bench_lifespan = (asyncio.Queue(), asyncio.Queue())
+        to_app, from_app = app._bench_lifespan
+        app._bench_lifespan_task = asyncio.create_task(app({"type": "lifespan", "asgi": {"version": "3.0"}}, to_app.get, from_app.put))
+    to_app, from_app = app._bench_lifespan
+    await to_app.put({"type": f"lifespan.{event}"})
+    reply = await from_app.get()
+    if not reply["type"].endswith(".complete"):
+        raise RuntimeError(f"App {event} failed: {reply}")
+
+
+def _get_json(url: str) -> dict:
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return json.loads(response.read())
+
+
+async def run_load(args) -> dict:
+    rng = random.Random(args.seed)
+    stats = LoadStats()
+    app = main = None
+    if args.url:
+        if websockets is None:
+            raise SystemExit("Benchmarking a running server needs the websockets package (pip install websockets)")
+        http_base = args.url.replace("ws://", "http://").replace("wss://", "https://").rsplit("/ws", 1)[0]
+        make_socket = lambda: RemoteSocket(args.url)
+    else:
+        use_scratch_db(args.db)
+        db.PERSISTENCE_MODE = args.persistence
+        seed_world(args.fauna, args.food, rng)
+        import main # Loads the world from the scratch database on import
+        main.scheduler.period = main.tick_metrics.period = args.tick_rate
+        app = main.app
+        await _lifespan(app, "startup")
+        make_socket = lambda: InProcessSocket(app)
+
+    clients = [SyntheticClient(i, make_socket(), stats, args, random.Random(rng.random())) for i in range(args.clients)]
+    # Join in waves so join latency reflects a busy server rather than one giant burst
+    for start in range(0, len(clients), args.join_batch):
+        results = await asyncio.gather(*(client.join() for client in clients[start:start + args.join_batch]), return_exceptions=True)
+        stats.errors.extend(str(result) for result in results if isinstance(result, Exception))
+
+    joined = [client for client in clients if client.joined.is_set()]
+    db_before = db.db_flush_stats() if main else _get_json(f"{http_base}/metrics/ticks")["db_writer"]
+    started = time.perf_counter()
+    receivers = [asyncio.create_task(client.receive_forever()) for client in joined]
+    actions = await asyncio.gather(*(client.act(started + args.duration) for client in joined), return_exceptions=True)
+    stats.errors.extend(str(result) for result in actions if isinstance(result, Exception))
+    await asyncio.sleep(0.5) # Let the last broadcasts arrive
+    elapsed = time.perf_counter() - started
+
+    if main:
+        await main.store.flush()
+        tick_stats, scheduler_stats, db_after = main.tick_metrics.stats(), main.scheduler.stats(), db.db_flush_stats()
+        connection_stats = main.manager.queue_stats()
+        journal_stats = main.journal.stats() if main.journal else None
+    else:
+        ticks = _get_json(f"{http_base}/metrics/ticks")
+        tick_stats, scheduler_stats, db_after = ticks["timings"], ticks["scheduler"], ticks["db_writer"]
+        connection_stats = _get_json(f"{http_base}/metrics/connections")["clients"]
+        journal_stats = ticks.get("journal")
+    for task in receivers:
+        task.cancel()
+    await asyncio.gather(*receivers, return_exceptions=True)
+    for client in clients:
+        try:
+            await client.socket.close()
+        except Exception:
+            pass
+    if main:
+        await _lifespan(app, "shutdown")
+
+    return {
+        "benchmark": "load",
+        "meta": run_metadata(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("func", "out")},
+        "clients": {"requested": args.clients, "joined": len(joined), "errors": len(stats.errors), "first_errors": stats.errors[:5]},
+        "join_latency_ms": summarize(stats.join_latency_ms),
+        "broadcast_latency_ms": summarize(stats.broadcast_latency_ms),
+        "messages": {
+            "sent": stats.messages_sent,
+            "received": stats.messages_received,
+            "bytes_received": stats.bytes_received,
+            "received_per_client_per_second": round(stats.messages_received / max(1, len(joined)) / elapsed, 3),
+            "dropped_by_server": sum(client.get("dropped", 0) for client in connection_stats.values()),
+            "rate_limited_by_server": sum(sum(client.get("rate_limited", {}).values()) for client in connection_stats.values()),
+        },
+        "ticks": {"scheduler": scheduler_stats, "timings": tick_stats},
+        "db": {"statements": db_after["statements"] - db_before["statements"], "flushes": db_after["flushes"] - db_before["flushes"], "max_flush_seconds": db_after["max_seconds"]},
+        "journal": journal_stats,
+        "memory": {"max_rss_kb": max_rss_kb() if main else None},
+        "elapsed_seconds": round(elapsed, 3),
+    }
+
+
+async def run_fauna(args) -> dict:
+    from fauna import create_fauna_manager
+    from protocol import TickDelta
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    use_scratch_db(args.db)
+    seed_world(args.fauna, args.food, rng)
+    world_state = db.load_state_from_db()
+    store = db.AsyncStore()
+    engine = create_fauna_manager(world_state, store, args.engine)
+    if hasattr(engine, "rng"):
+        import numpy
+        engine.rng = numpy.random.default_rng(args.seed)
+    rss_before = max_rss_kb()
+    tick_ms, flush_ms, events = [], [], {"moved": 0, "updated": 0, "spawned": 0, "removed": 0, "food_eaten": 0}
+    statements_before = db.db_flush_stats()["statements"]
+    for tick in range(1, args.ticks + 1):
+        delta = TickDelta(tick)
+        started = time.perf_counter()
+        to_add, to_remove, food_eaten = await engine.update_fauna(delta, args.dt)
+        tick_ms.append((time.perf_counter() - started) * 1000)
+        for new_id, new_data in to_add:
+            world_state["fauna"][new_id] = new_data
+        for fauna_id in to_remove:
+            world_state["fauna"].pop(fauna_id, None)
+        for food_id in food_eaten:
+            engine.remove_food(food_id)
+        started = time.perf_counter()
+        await store.flush()
+        flush_ms.append((time.perf_counter() - started) * 1000)
+        events["moved"] += len(delta.fauna_moved)
+        events["updated"] += len(delta.fauna_updated)
+        events["spawned"] += len(to_add)
+        events["removed"] += len(to_remove)
+        events["food_eaten"] += len(food_eaten)
+    statements = db.db_flush_stats()["statements"] - statements_before
+    await store.close()
+    return {
+        "benchmark": "fauna",
+        "meta": run_metadata(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("func", "out")},
+        "engine": type(engine).__name__,
+        "update_fauna_ms": summarize(tick_ms),
+        "flush_ms": summarize(flush_ms),
+        "events": events,
+        "db": {"statements": statements, "statements_per_tick": round(statements / args.ticks, 3)},
+        "memory": {"max_rss_kb_before": rss_before, "max_rss_kb": max_rss_kb()},
+        "final_fauna": len(world_state["fauna"]),
+    }
+
+
+# --- Engine Comparison ---
+class PinnedRandom:
+    """Stands in for the random module in fauna.py: every roll is the same and randint picks the middle."""
+
+    def __init__(self, roll: float):
+        self.roll = roll
+
+    def random(self):
+        return self.roll
+
+    def randint(self, low, high):
+        return (low + high) // 2
+
+
+class PinnedGenerator:
+    """The same for the vector engine's NumPy generator (integers() excludes high, randint() doesn't)."""
+
+    def __init__(self, roll: float):
+        self.roll = roll
+
+    def random(self, size=None):
+        import numpy
+        return self.roll if size is None else numpy.full(size, self.roll)
+
+    def integers(self, low, high, size=None):
+        import numpy
+        return numpy.full(size, (low + high - 1) // 2)
+
+
+class PinnedClock:
+    """Stands in for the time module: time() only moves when the comparison advances it."""
+
+    def __init__(self, now: float):
+        self.now = now
+        self.perf_counter = time.perf_counter
+
+    def time(self):
+        return self.now
+
+
+class CountingUuid:
+    """Stands in for the uuid module, so both engines name their offspring the same way."""
+
+    def __init__(self):
+        self.count = 0
+
+    def uuid4(self):
+        self.count += 1
+        return uuid.UUID(int=self.count)
+
+
+async def record_engine(engine: str, world_state: dict, start: float, args) -> tuple:
+    """Runs one engine for args.ticks ticks and returns (every tick's frame and spawns, the final fauna)."""
+    import fauna
+    import fauna_vector
+    from journal import DiscardingStore
+    from protocol import TickDelta
+    clock = PinnedClock(start)
+    pinned = {fauna: {"random": PinnedRandom(args.roll), "time": clock, "uuid": CountingUuid()}, fauna_vector: {"time": clock, "uuid": CountingUuid()}}
+    originals = {module: {name: getattr(module, name) for name in names} for module, names in pinned.items()}
+    try:
+        for module, names in pinned.items():
+            for name, value in names.items():
+                setattr(module, name, value)
+        manager = fauna.create_fauna_manager(world_state, DiscardingStore(), engine)
+        if engine == "vector":
+            if not hasattr(manager, "rng"):
+                raise SystemExit("Comparing engines needs NumPy for the vector engine (pip install numpy)")
+            manager.rng = PinnedGenerator(args.roll)
+        ticks = []
+        for tick in range(1, args.ticks + 1):
+            clock.now += args.dt
+            delta = TickDelta(tick)
+            to_add, to_remove, food_eaten = await manager.update_fauna(delta, args.dt)
+            # Applied the way main.py's game loop does it
+            for new_id, new_data in to_add:
+                world_state["fauna"][new_id] = new_data
+                delta.fauna_spawn(new_id, new_data)
+            for fauna_id in to_remove:
+                if world_state["fauna"].pop(fauna_id, None) is not None:
+                    delta.fauna_remove(fauna_id)
+            for food_id in food_eaten:
+                if manager.remove_food(food_id):
+                    delta.food_remove(food_id)
+            frame = delta.to_frame()
+            # Which order fauna produce events in within a tick is up to the engine, so id lists are compared as sets
+            for name in ("fauna_removed", "food_removed"):
+                if name in frame:
+                    frame[name] = sorted(frame[name])
+            ticks.append(json.loads(json.dumps(frame)))
+        manager.sync_world_state()
+        return ticks, json.loads(json.dumps(world_state["fauna"]))
+    finally:
+        for module, names in originals.items():
+            for name, value in names.items():
+                setattr(module, name, value)
+
+
+def diff_values(before, after, path="", limit=20) -> list:
+    """Paths where two JSON-like values differ (numbers compare by value, so 3 == 3.0)."""
+    if isinstance(before, dict) and isinstance(after, dict):
+        differences = []
+        for key in sorted(before.keys() | after.keys()):
+            if key not in before or key not in after:
+                differences.append(f"{path}.{key}: only in {'vector' if key not in before else 'dict'}")
+            else:
+                differences.extend(diff_values(before[key], after[key], f"{path}.{key}", limit))
+            if len(differences) >= limit:
+                break
+        return differences[:limit]
+    if isinstance(before, list) and isinstance(after, list) and len(before) == len(after):
+        differences = []
+        for i, (a, b) in enumerate(zip(before, after)):
+            differences.extend(diff_values(a, b, f"{path}[{i}]", limit))
+            if len(differences) >= limit:
+                break
+        return differences[:limit]
+    return [] if before == after else [f"{path}: dict {before!r} != vector {after!r}"]
+
+
+async def run_engines(args) -> dict:
+    rng = random.Random(args.seed)
+    use_scratch_db(args.db)
+    seed_world(args.fauna, args.food, rng)
+    world_state = db.load_state_from_db()
+    db.close_db()
+    start = time.time()
+    dict_ticks, dict_fauna = await record_engine("dict", copy.deepcopy(world_state), start, args)
+    vector_ticks, vector_fauna = await record_engine("vector", copy.deepcopy(world_state), start, args)
+    differences = diff_values(dict_ticks, vector_ticks, "ticks") + diff_values(dict_fauna, vector_fauna, "final_fauna")
+    events = {name: sum(len(frame.get(name, ())) for frame in dict_ticks) for name in ("fauna_moved", "fauna_updated", "fauna_spawned", "fauna_removed", "food_removed")}
+    return {
+        "benchmark": "engines",
+        "meta": run_metadata(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("func", "out")},
+        "identical": not differences,
+        "events": events,
+        "final_fauna": len(dict_fauna),
+        "first_differences": differences[:20],
+    }
+
+
+def run_replay(args) -> dict:
+    """Times read_snapshot and replay_segment separately for the newest snapshot in a journal directory."""
+    from journal import snapshot_seqs, read_snapshot, replay_segment, segment_path
+    seqs = snapshot_seqs(args.journal)
+    if not seqs:
+        raise SystemExit(f"No snapshots in {args.journal}")
+    started = time.perf_counter()
+    state = read_snapshot(args.journal, seqs[-1])
+    snapshot_seconds = time.perf_counter() - started
+    snapshot_fauna = len(state["fauna"])
+    segment = segment_path(args.journal, seqs[-1])
+    started = time.perf_counter()
+    ticks = replay_segment(state, segment)
+    replay_seconds = time.perf_counter() - started
+    return {
+        "benchmark": "replay",
+        "meta": run_metadata(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("func", "out")},
+        "snapshot": {"seq": seqs[-1], "fauna": snapshot_fauna, "seconds": round(snapshot_seconds, 4)},
+        "journal": {"ticks": ticks, "bytes": os.path.getsize(segment) if os.path.exists(segment) else 0, "seconds": round(replay_seconds, 4)},
+        "world": {"fauna": len(state["fauna"]), "food": len(state["food"]), "map_tiles": state["map"].width * state["map"].height},
+        "memory": {"max_rss_kb": max_rss_kb()},
+    }
+
+
+def _flatten(value, prefix=""):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from _flatten(item, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+
+def compare(args):
+    """Prints every numeric result that changed between two runs, with the relative change."""
+    with open(args.before) as f:
+        before = dict(_flatten(json.load(f)))
+    with open(args.after) as f:
+        after = dict(_flatten(json.load(f)))
+    rows = []
+    for key in sorted(before.keys() & after.keys()):
+        if key.startswith(("meta.", "params.")) or before[key] == after[key]:
+            continue
+        change = f"{(after[key] - before[key]) / before[key] * 100:+.1f}%" if before[key] else "n/a"
+        rows.append({"metric": key, "before": before[key], "after": after[key], "change": change})
+    print(json.dumps(rows, indent=2))
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Project Arbor load test and benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    load = commands.add_parser("load", help="Synthetic websocket clients against the game server")
+    load.add_argument("--clients", type=int, default=DEFAULT_CLIENTS)
+    load.add_argument("--duration", type=float, default=DEFAULT_DURATION)
+    load.add_argument("--join-batch", type=int, default=10, help="Clients that join at the same time")
+    load.add_argument("--move-rate", type=float, default=DEFAULT_MOVE_RATE)
+    load.add_argument("--drop-food-rate", type=float, default=DEFAULT_DROP_FOOD_RATE)
+    load.add_argument("--till-rate", type=float, default=DEFAULT_TILL_RATE)
+    load.add_argument("--protocol", type=int, default=2)
+    load.add_argument("--encoding", choices=("json", "binary"), default="json")
+    load.add_argument("--sync", choices=("full", "chunked"), default="full")
+    load.add_argument("--url", help="Benchmark a running server (ws://host:port/ws) instead of an in-process one")
+    load.add_argument("--tick-rate", type=float, default=DEFAULT_TICK_RATE, help="In-process game loop period")
+    load.add_argument("--fauna", type=int, default=100, help="Fauna to seed the in-process world with")
+    load.add_argument("--food", type=int, default=50)
+    load.add_argument("--persistence", choices=db.PERSISTENCE_MODES, default=db.PERSISTENCE_MODE, help="Row writes or snapshots plus a tick journal")
+    load.set_defaults(func=lambda args: asyncio.run(run_load(args)))
+
+    fauna = commands.add_parser("fauna", help="FaunaManager.update_fauna on its own")
+    fauna.add_argument("--fauna", type=int, default=5000)
+    fauna.add_argument("--food", type=int, default=500)
+    fauna.add_argument("--ticks", type=int, default=20)
+    fauna.add_argument("--dt", type=float, default=3.0, help="Seconds each tick advances")
+    fauna.add_argument("--engine", choices=("dict", "vector"), default="dict")
+    fauna.set_defaults(func=lambda args: asyncio.run(run_fauna(args)))
+
+    engines = commands.add_parser("engines", help="Check that the dict and vector fauna engines produce the same ticks")
+    engines.add_argument("--fauna", type=int, default=500)
+    engines.add_argument("--food", type=int, default=100)
+    engines.add_argument("--ticks", type=int, default=10)
+    engines.add_argument("--dt", type=float, default=3.0, help="Seconds each tick advances")
+    engines.add_argument("--roll", type=float, default=0.0, help="What every random roll returns (0 makes every chance succeed)")
+    engines.set_defaults(func=lambda args: asyncio.run(run_engines(args)))
+
+    for command in (load, fauna, engines):
+        command.add_argument("--seed", type=int, default=DEFAULT_SEED)
+        command.add_argument("--db", help="Database file to seed and use (default: a fresh temp file)")
+        command.add_argument("--out", help="Write the JSON results here instead of stdout")
+
+    replay = commands.add_parser("replay", help="Load a journal directory's latest snapshot and replay its ticks")
+    replay.add_argument("--journal", required=True, help="Journal directory (the database path minus .db, plus _journal)")
+    replay.add_argument("--out", help="Write the JSON results here instead of stdout")
+    replay.set_defaults(func=run_replay)
+
+    diff = commands.add_parser("compare", help="Diff two result files")
+    diff.add_argument("before")
+    diff.add_argument("after")
+    diff.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    results = args.func(args)
+    if results is not None:
+        write_results(results, args.out)
+
+
+if __name__ == "__main__":
+    main_cli()
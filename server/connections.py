@@ -0,0 +1,519 @@
+import math
+import uuid
+import asyncio
+from collections import deque
+from typing import List, Optional
+from fastapi import WebSocket
+
+from protocol import TickDelta, FrameEncoders, PROTOCOL_LEGACY, PROTOCOL_DELTA, ENCODING_JSON, FRAME_DATA_SECTIONS
+from spatial import SpatialGrid
+from world_sync import MapChunkCache, sync_messages, SYNC_FULL, SYNC_CHUNKED
+from tilemap import encode_world, TILE_SIZE
+from ratelimit import RateLimiter
+from instrumentation import metrics, encode_message
+
+# --- Outbound Queue Configuration ---
+OUTBOUND_QUEUE_SIZE = 256 # Messages a client may fall behind by before the slow consumer policy kicks in
+SLOW_CONSUMER_POLICY = "drop_oldest" # "drop_oldest", "coalesce" or "disconnect"
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+# --- Interest Management Configuration ---
+INTEREST_MANAGEMENT = True # Protocol 2 clients only hear about entities near their player
+# The area of interest is a rectangle INTEREST_RADIUS_X by INTEREST_RADIUS_Y out from the player: half
+# a viewport centred on them, plus a margin so entities are known a little before they scroll into view
+VIEWPORT_WIDTH = 800
+VIEWPORT_HEIGHT = 600
+INTEREST_MARGIN = 128
+INTEREST_RADIUS_X = VIEWPORT_WIDTH // 2 + INTEREST_MARGIN
+INTEREST_RADIUS_Y = VIEWPORT_HEIGHT // 2 + INTEREST_MARGIN
+INTEREST_CHECKS = False # Debug: check every filtered frame only carries entities inside the client's area of interest
+INTEREST_CELL_SIZE = 128 # Also how far a player has to move before their area of interest is recomputed
+ENTITY_KINDS = ("fauna", "food", "players") # world_state collections covered by interest management
+
+_CLOSE = object() # Queue sentinel: stop the sender once everything before it has gone out
+
+
+class ClientConnection:
+    """One websocket plus its bounded outbound queue and the task that drains it."""
+
+    def __init__(self, websocket: WebSocket, player_id: str, policy: str, max_queue: int):
+        self.websocket = websocket
+        self.player_id = player_id
+        self.protocol = PROTOCOL_LEGACY
+        self.sync = SYNC_FULL
+        self.encoding = ENCODING_JSON
+        self.policy = policy
+        self.max_queue = max_queue
+        # Entries are [key, message] so a coalesced update can replace a queued one in place
+        self.queue = deque()
+        self.queued_by_key = {}
+        self.ready = asyncio.Event()
+        self.drained = asyncio.Event() # Set whenever the queue has room again, for streams waiting on it
+        self.closing = False
+        self.sender_task = None
+        # --- Streams ---
+        self.stream_lock = asyncio.Lock()
+        # While a stream is being queued, what is sent to this client meanwhile: bounded and coalesced like the queue
+        self.held = None
+        self.held_by_key = {}
+        # --- Area of interest ---
+        self.position = None # Where this client's player is, once it has joined
+        self.interest_cell = None
+        self.visible = set() # (kind, id) of every entity this client currently knows about
+        # --- Inbound ---
+        self.limiter = RateLimiter()
+        # --- Metrics ---
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+
+    def start(self, on_failure):
+        self.sender_task = asyncio.create_task(self._sender(on_failure))
+
+    def enqueue(self, message, key: Optional[str] = None) -> bool:
+        """Queues a message without waiting. Returns False if the client is too slow and must be dropped."""
+        if self.closing:
+            return True
+        if self.held is not None:
+            return self._append(self.held, self.held_by_key, message, key)
+        if not self._append(self.queue, self.queued_by_key, message, key):
+            return False
+        self.max_depth = max(self.max_depth, len(self.queue))
+        self.ready.set()
+        return True
+
+    def _append(self, queue: deque, by_key: dict, message, key: Optional[str]) -> bool:
+        """Adds to the queue or the held messages, applying the slow consumer policy when it is full."""
+        if self.policy == "coalesce" and key is not None and key in by_key:
+            # Still unsent, so the client only needs the newest version
+            by_key[key][1] = message
+            self.coalesced += 1
+            return True
+        if len(queue) >= self.max_queue:
+            if self.policy == "disconnect":
+                return False
+            old_key, _ = queue.popleft()
+            if old_key is not None:
+                by_key.pop(old_key, None)
+            self.dropped += 1
+        entry = [key, message]
+        queue.append(entry)
+        if key is not None:
+            by_key[key] = entry
+        return True
+
+    def push(self, message):
+        """Queues a message that must not be dropped or coalesced. Callers wait for room first."""
+        self.queue.append([None, message])
+        self.max_depth = max(self.max_depth, len(self.queue))
+        self.ready.set()
+
+    async def wait_for_room(self, room: int = 1):
+        """Waits until at least room more messages fit in the queue (max_queue waits for it to empty)."""
+        while len(self.queue) > self.max_queue - room and not self.closing:
+            self.drained.clear()
+            await self.drained.wait()
+
+    def interest_rect(self):
+        x, y = self.position
+        return (x - INTEREST_RADIUS_X, y - INTEREST_RADIUS_Y, x + INTEREST_RADIUS_X, y + INTEREST_RADIUS_Y)
+
+    def close_after_drain(self):
+        self.queue.append([None, _CLOSE])
+        self.closing = True
+        self.ready.set()
+        self.drained.set()
+
+    async def _sender(self, on_failure):
+        try:
+            while True:
+                while not self.queue:
+                    self.ready.clear()
+                    await self.ready.wait()
+                entry = self.queue.popleft()
+                self.drained.set()
+                key, message = entry
+                if key is not None and self.queued_by_key.get(key) is entry:
+                    del self.queued_by_key[key]
+                if message is _CLOSE:
+                    await self.websocket.close()
+                    return
+                if isinstance(message, bytes):
+                    await self.websocket.send_bytes(message)
+                else:
+                    await self.websocket.send_text(message)
+                self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error sending message to player {self.player_id}: {e}")
+            on_failure(self.websocket)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": len(self.queue),
+            "max_queue_depth": self.max_depth,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "protocol": self.protocol,
+            "sync": self.sync,
+            "encoding": self.encoding,
+            "visible_entities": len(self.visible),
+            "rate_limited": dict(self.limiter.rejected),
+        }
+
+
+def finite_position(x, y) -> bool:
+    """Whether x and y are both real, finite numbers; client-sent positions can be anything JSON allows."""
+    return all(isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v) for v in (x, y))
+
+
+class ConnectionManager:
+    """Tracks connected clients. Fan-out only enqueues, so one stalled client can't hold up the rest."""
+
+    def __init__(self, world_state: dict, policy: str = SLOW_CONSUMER_POLICY, max_queue: int = OUTBOUND_QUEUE_SIZE):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy '{policy}', expected one of {SLOW_CONSUMER_POLICIES}")
+        self.world_state = world_state
+        self.policy = policy
+        self.max_queue = max_queue
+        self.active_connections: List[WebSocket] = []
+        self.clients = {}
+        # Every fauna, food and player position, keyed by (kind, id), for area of interest queries
+        self.entities = SpatialGrid(INTEREST_CELL_SIZE)
+        self.tick = 0
+        self.streams = set() # Background world streams (after a reset), kept referenced until they finish
+        self.rebuild_interest()
+    def clamp_position(self, x, y):
+        """(x, y) clamped to the world's pixel bounds, or None if either is not a finite number."""
+        if not finite_position(x, y):
+            return None
+        tile_map = self.world_state["map"]
+        return (min(max(x, 0), tile_map.width * TILE_SIZE), min(max(y, 0), tile_map.height * TILE_SIZE))
+    async def connect(self, websocket: WebSocket) -> str:
+        await websocket.accept()
+        player_id = str(uuid.uuid4().hex[:6])
+        client = ClientConnection(websocket, player_id, self.policy, self.max_queue)
+        self.active_connections.append(websocket)
+        self.clients[websocket] = client
+        client.start(self.disconnect)
+        return player_id
+    def disconnect(self, websocket: WebSocket):
+        client = self.clients.pop(websocket, None)
+        if client is None:
+            return None
+        self.active_connections.remove(websocket)
+        client.closing = True
+        client.drained.set()
+        if client.sender_task is not None and client.sender_task is not asyncio.current_task():
+            client.sender_task.cancel()
+        return client.player_id
+    async def close(self, websocket: WebSocket):
+        """Sends whatever is still queued for this client, then closes its socket."""
+        client = self.clients.get(websocket)
+        if client is None:
+            return
+        client.close_after_drain()
+        await asyncio.shield(client.sender_task)
+        self.disconnect(websocket)
+    def set_protocol(self, websocket: WebSocket, version: int):
+        self.clients[websocket].protocol = version
+    def set_sync(self, websocket: WebSocket, mode: str):
+        self.clients[websocket].sync = mode
+    def set_encoding(self, websocket: WebSocket, encoding: str):
+        self.clients[websocket].encoding = encoding
+    def has_legacy_clients(self) -> bool:
+        """Whether any connected client still gets per-event messages, so a tick has to keep per-event records."""
+        return any(client.protocol < PROTOCOL_DELTA for client in self.clients.values())
+    def allow(self, websocket: WebSocket, message_type: str) -> bool:
+        """Spends a token from the client's bucket for this message type; False means reject the message."""
+        client = self.clients.get(websocket)
+        return client is not None and client.limiter.allow(message_type)
+    async def send(self, websocket: WebSocket, message: str, key: Optional[str] = None):
+        """Queues a message for one client."""
+        self._enqueue([websocket], message, key)
+    async def broadcast(self, message: str, key: Optional[str] = None):
+        """Queues a message for every client. key marks state updates the coalesce policy may merge."""
+        with metrics.timer("broadcast", path="broadcast"):
+            self._enqueue(self.active_connections[:], message, key)  # Use slice to avoid modification during iteration
+    async def stream(self, websocket: WebSocket, messages):
+        """
+        Queues a run of messages that has to arrive whole and in order (a world sync). Instead of
+        dropping, it waits for room in the client's queue; anything else sent to the client meanwhile
+        is held back (up to the queue size, under the slow consumer policy) and queued after the run.
+        """
+        client = self.clients.get(websocket)
+        if client is None:
+            return
+        async with client.stream_lock:
+            client.held = deque()
+            try:
+                for message in messages:
+                    await client.wait_for_room()
+                    if client.closing:
+                        return
+                    client.push(message)
+                # Let the run go out before the held messages, so the slow consumer policy can't drop part of it
+                await client.wait_for_room(client.max_queue)
+            finally:
+                held, client.held, client.held_by_key = client.held, None, {}
+                for key, message in held:
+                    self._enqueue([websocket], message, key)
+    async def sync_world(self, websocket: WebSocket, map_chunks: MapChunkCache, player_id: Optional[str] = None, reason: str = "join"):
+        """Streams the world to a chunked sync client. Filtered clients only get what is in their area of interest."""
+        client = self.clients.get(websocket)
+        if client is None:
+            return
+        # Copy the entities now so a tick that runs between pages can't tear the snapshot
+        if self._filtered(client):
+            client.visible = {key for key, _, _ in self.entities.query_rect(*client.interest_rect())}
+            entities = {kind: [] for kind in ENTITY_KINDS}
+            for kind, entity_id in client.visible:
+                entities[kind].append((entity_id, dict(self.world_state[kind][entity_id])))
+        else:
+            entities = {kind: [(entity_id, dict(data)) for entity_id, data in self.world_state[kind].items()] for kind in ENTITY_KINDS}
+        await self.stream(websocket, sync_messages(map_chunks, entities, player_id, reason))
+    async def reset_world(self, map_chunks: MapChunkCache):
+        """
+        After a zone reset, resends the world: chunked sync clients get the stream, the rest one world_reset
+        message. Streams run in the background so a slow client doesn't hold up whoever issued the reset.
+        """
+        self.rebuild_interest()
+        reset_message = None
+        for websocket, client in list(self.clients.items()):
+            if client.sync == SYNC_CHUNKED:
+                task = asyncio.create_task(self.sync_world(websocket, map_chunks, reason="reset"))
+                self.streams.add(task)
+                task.add_done_callback(self._stream_done)
+                continue
+            if reset_message is None:
+                reset_message = encode_message({"type": "world_reset", "world": self.world_state}, default=encode_world)
+            self._enqueue([websocket], reset_message)
+            if client.position is not None:
+                client.visible = set(self.entities.positions)
+                await self.refresh_interest(websocket)
+    def _stream_done(self, task: asyncio.Task):
+        self.streams.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"World stream failed: {task.exception()}")
+    async def broadcast_delta(self, delta: TickDelta):
+        """
+        Sends one tick's changes. Protocol 2 clients get one frame, trimmed to their area of interest
+        when they have a position; legacy clients get the per-event messages.
+        """
+        self.tick = delta.tick
+        self._index_delta(delta)
+        if delta.is_empty():
+            return
+        with metrics.timer("broadcast", path="delta"):
+            self._fan_out_delta(delta)
+    def _fan_out_delta(self, delta: TickDelta):
+        full_clients, filtered_clients, legacy_clients = {}, [], []
+        for connection in self.active_connections[:]:
+            client = self.clients[connection]
+            if self._filtered(client):
+                filtered_clients.append(connection)
+            elif client.protocol >= PROTOCOL_DELTA:
+                full_clients.setdefault(client.encoding, []).append(connection)
+            else:
+                legacy_clients.append(connection)
+        frame = delta.to_frame()
+        encoders = FrameEncoders(delta.tick)
+        full_sections = {name: section for name, section in frame.items() if name not in ("type", "tick")}
+        for encoding, connections in full_clients.items():
+            self._enqueue(connections, encoders.encode(encoding, full_sections))
+        for connection in filtered_clients:
+            client = self.clients[connection]
+            sections = self._interest_frame(client, frame)
+            if INTEREST_CHECKS:
+                check_interest(client, sections, self.entities)
+            if any(sections.values()):
+                self._enqueue([connection], encoders.encode(client.encoding, sections))
+        if legacy_clients:
+            for message in delta.to_legacy_messages():
+                key = f"{message['type']}:{message['fauna_id']}" if message["type"] == "fauna_moved" else None
+                self._enqueue(legacy_clients, encode_message(message), key)
+    # --- Interest management ---
+    def rebuild_interest(self):
+        """Re-indexes every entity in world_state, e.g. after a zone reset."""
+        self.entities.clear()
+        for kind in ENTITY_KINDS:
+            for entity_id, data in self.world_state[kind].items():
+                position = self.clamp_position(data["x"], data["y"])
+                if position is not None:
+                    self.entities.insert((kind, entity_id), *position)
+    def _filtered(self, client: ClientConnection) -> bool:
+        return INTEREST_MANAGEMENT and client.protocol >= PROTOCOL_DELTA and client.position is not None
+    def _index_delta(self, delta: TickDelta):
+        for fauna_id in delta.fauna_removed:
+            self.entities.remove(("fauna", fauna_id))
+        for fauna_id, fauna in delta.fauna.items():
+            if fauna_id in self.world_state["fauna"]:
+                self.entities.move(("fauna", fauna_id), fauna["x"], fauna["y"])
+        for food_id in delta.food_removed:
+            self.entities.remove(("food", food_id))
+        for food_id, food in delta.food_spawned.items():
+            self.entities.insert(("food", food_id), food["x"], food["y"])
+    def _interest_sections(self, client: ClientConnection, gone=()) -> dict:
+        """Recomputes what a client should see and returns entered/left sections for the difference."""
+        interest = {key for key, _, _ in self.entities.query_rect(*client.interest_rect())}
+        visible = client.visible.difference(gone)
+        entered, left = interest - visible, visible - interest
+        client.visible = interest
+        sections = {}
+        for kind in ENTITY_KINDS:
+            sections[f"{kind}_entered"] = {entity_id: self.world_state[kind][entity_id] for k, entity_id in entered if k == kind}
+            sections[f"{kind}_left"] = [entity_id for k, entity_id in left if k == kind]
+        return sections
+    def _interest_frame(self, client: ClientConnection, frame: dict) -> dict:
+        """Trims a tick frame to what one client can see, adding enter/leave entries for what crossed its boundary."""
+        knew = client.visible
+        removed_fauna, removed_food = frame.get("fauna_removed", []), frame.get("food_removed", [])
+        sections = {
+            "fauna_removed": [fid for fid in removed_fauna if ("fauna", fid) in knew],
+            "food_removed": [fid for fid in removed_food if ("food", fid) in knew],
+        }
+        gone = {("fauna", fid) for fid in removed_fauna} | {("food", fid) for fid in removed_food}
+        interest_sections = self._interest_sections(client, gone)
+        now_visible = client.visible
+        # Spawns are sent in their own sections rather than as "entered"
+        sections["fauna_spawned"] = {fid: data for fid, data in frame.get("fauna_spawned", {}).items() if ("fauna", fid) in now_visible}
+        sections["food_spawned"] = {fid: data for fid, data in frame.get("food_spawned", {}).items() if ("food", fid) in now_visible}
+        for fid in sections["fauna_spawned"]:
+            interest_sections["fauna_entered"].pop(fid, None)
+        for fid in sections["food_spawned"]:
+            interest_sections["food_entered"].pop(fid, None)
+        for name in ("fauna_moved", "fauna_updated"):
+            sections[name] = {fid: data for fid, data in frame.get(name, {}).items() if ("fauna", fid) in knew and ("fauna", fid) in now_visible}
+        sections.update(interest_sections)
+        return sections
+    async def refresh_interest(self, websocket: WebSocket):
+        """Sends a client enter/leave updates for its current area of interest."""
+        client = self.clients.get(websocket)
+        if client is None or not self._filtered(client):
+            return
+        sections = self._interest_sections(client)
+        if INTEREST_CHECKS:
+            check_interest(client, sections, self.entities)
+        if any(sections.values()):
+            self._enqueue([websocket], FrameEncoders(self.tick).encode(client.encoding, sections))
+    async def track_viewer(self, websocket: WebSocket, x, y, sent_world: bool = True):
+        """
+        Starts interest filtering for a client. sent_world says it has just been sent the whole world;
+        chunked sync clients are tracked first and then only sent what they can see.
+        """
+        client = self.clients[websocket]
+        position = self.clamp_position(x, y)
+        if position is None:
+            print(f"Not tracking {client.player_id}: bad position ({x!r}, {y!r})")
+            return
+        x, y = position
+        self.entities.move(("players", client.player_id), x, y)
+        client.position = (x, y)
+        client.interest_cell = (int(x // INTEREST_CELL_SIZE), int(y // INTEREST_CELL_SIZE))
+        if sent_world:
+            client.visible = set(self.entities.positions)
+            await self.refresh_interest(websocket)
+    async def move_viewer(self, websocket: WebSocket, x, y):
+        """Updates a client's position, re-checking its area of interest once it moves into another cell."""
+        client = self.clients.get(websocket)
+        if client is None or client.position is None:
+            return
+        position = self.clamp_position(x, y)
+        if position is None:
+            print(f"Ignoring a bad position ({x!r}, {y!r}) for {client.player_id}")
+            return
+        x, y = client.position = position
+        cell = (int(x // INTEREST_CELL_SIZE), int(y // INTEREST_CELL_SIZE))
+        if cell != client.interest_cell:
+            client.interest_cell = cell
+            await self.refresh_interest(websocket)
+    async def broadcast_entity(self, kind: str, entity_id: str, message: str, key: Optional[str] = None, spawned: bool = False):
+        """
+        Broadcasts an update about one entity (a player move, a dropped food...). Filtered clients only
+        get it while the entity is in their area of interest, and get enter/leave entries as it crosses.
+        spawned marks messages that announce a new entity, which need no separate "entered" entry.
+        """
+        with metrics.timer("broadcast", path="entity", kind=kind):
+            self._fan_out_entity(kind, entity_id, message, key, spawned)
+    def _fan_out_entity(self, kind: str, entity_id: str, message: str, key: Optional[str], spawned: bool):
+        data = self.world_state[kind][entity_id]
+        entity_key = (kind, entity_id)
+        # The index is shared by every viewer, so a position it can't hold is refused for this entity only
+        position = self.clamp_position(data["x"], data["y"])
+        if position is None:
+            print(f"Not broadcasting {kind} {entity_id}: bad position ({data['x']!r}, {data['y']!r})")
+            return
+        x, y = position
+        self.entities.move(entity_key, x, y)
+        recipients, entered, left = [], [], []
+        for connection in self.active_connections[:]:
+            client = self.clients[connection]
+            if not self._filtered(client):
+                recipients.append(connection)
+                continue
+            min_x, min_y, max_x, max_y = client.interest_rect()
+            inside = min_x <= x <= max_x and min_y <= y <= max_y
+            if inside and (spawned or entity_key in client.visible):
+                client.visible.add(entity_key)
+                recipients.append(connection)
+            elif inside:
+                client.visible.add(entity_key)
+                entered.append(connection)
+            elif entity_key in client.visible:
+                client.visible.discard(entity_key)
+                left.append(connection)
+        self._enqueue(recipients, message, key)
+        encoders = FrameEncoders(self.tick)
+        for connection in entered:
+            self._enqueue([connection], encoders.encode(self.clients[connection].encoding, {f"{kind}_entered": {entity_id: data}}))
+        for connection in left:
+            self._enqueue([connection], encoders.encode(self.clients[connection].encoding, {f"{kind}_left": [entity_id]}))
+    def untrack_entity(self, kind: str, entity_id: str):
+        """Forgets an entity that has left the world (the caller broadcasts the removal itself)."""
+        self.entities.remove((kind, entity_id))
+        for client in self.clients.values():
+            client.visible.discard((kind, entity_id))
+    def _enqueue(self, connections: List[WebSocket], message, key: Optional[str] = None):
+        if metrics.enabled:
+            metrics.count("outbound_messages", len(connections))
+            metrics.count("outbound_bytes", len(message) * len(connections))
+        too_slow = []
+        for connection in connections:
+            client = self.clients.get(connection)
+            if client is not None and not client.enqueue(message, key):
+                too_slow.append(connection)
+
+        # Clean up clients that fell too far behind under the disconnect policy
+        for connection in too_slow:
+            print(f"Disconnecting slow client {self.clients[connection].player_id}: outbound queue full")
+            self.disconnect(connection)
+            asyncio.create_task(self._close_quietly(connection))
+    async def _close_quietly(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=1013) # Try again later
+        except Exception:
+            pass
+    def queue_stats(self) -> dict:
+        """Per-client outbound queue metrics, keyed by player id."""
+        return {client.player_id: client.stats() for client in self.clients.values()}
+
+
+def check_interest(client: ClientConnection, sections: dict, entities: SpatialGrid):
+    """Raises AssertionError if a filtered client is sent, or thinks it can see, an entity outside its area of interest."""
+    min_x, min_y, max_x, max_y = client.interest_rect()
+    for name, content in sections.items():
+        if name not in FRAME_DATA_SECTIONS:
+            continue
+        kind = name.split("_")[0]
+        for entity_id, data in content.items():
+            # Interest is decided on indexed positions; a player's record can be a move ahead of the index
+            x, y = entities.get((kind, entity_id)) or (data["x"], data["y"])
+            if not (min_x <= x <= max_x and min_y <= y <= max_y):
+                raise AssertionError(f"{name} sent {entity_id} at ({x}, {y}) to {client.player_id}, whose area of interest is {client.interest_rect()}")
+    for key in client.visible:
+        position = entities.get(key)
+        if position is not None and not (min_x <= position[0] <= max_x and min_y <= position[1] <= max_y):
+            raise AssertionError(f"{client.player_id} still sees {key} at {position}, outside {client.interest_rect()}")
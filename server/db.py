@@ -1,13 +1,56 @@
+import os
 import sqlite3
 import json
 import random
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any
 
+from tilemap import TileMap
+from journal import load_world
+from instrumentation import metrics
+
 DB_FILE = "project_arbor.db"
 
+# --- Map Storage ---
+MAP_ZONE = "default" # Key of this database's map in zone_map (each sharded zone has its own database file)
+MAP_WIDTH = 50 # Tiles, for newly created worlds
+MAP_HEIGHT = 38
+
+# --- Persistence Mode ---
+PERSISTENCE_MODE = "rows" # "rows": fauna, food and map changes are row writes; "journal": snapshots plus a tick journal (journal.py)
+PERSISTENCE_MODES = ("rows", "journal")
+
+# --- Write-Behind Configuration ---
+DB_FLUSH_INTERVAL = 1.0 # Durability window: queued writes reach disk at most this many seconds late
+DB_MAX_PENDING_WRITES = 5000 # Flush early if this many writes pile up inside one window
+
+_conn = None
+_conn_lock = threading.RLock()
+_pending_writes = [] # (query, params, kind): kind is False, True for executemany, or _REGION
+_pending_lock = threading.Lock() # Taken inside _conn_lock when both are held
+_flush_requested = threading.Event()
+_writer_stopping = threading.Event()
+_writer_thread = None
+_REGION = "region" # Queued map region change; params are (zone, x, y, w, h, tile bytes)
+_flush_stats = {"flushes": 0, "statements": 0, "last_seconds": 0.0, "max_seconds": 0.0}
+
+def get_connection() -> sqlite3.Connection:
+    """Returns the long-lived connection shared by every helper in this module."""
+    global _conn
+    with _conn_lock:
+        if _conn is None:
+            _conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+            _conn.execute("PRAGMA journal_mode=WAL")
+            _conn.execute("PRAGMA synchronous=NORMAL")
+        return _conn
+
 def init_db():
     """Initializes the database and creates tables if they don't exist."""
-    with sqlite3.connect(DB_FILE) as conn:
+    conn = get_connection()
+    with _conn_lock:
         cursor = conn.cursor()
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS users (
@@ -38,6 +81,7 @@ def init_db():
                 y REAL NOT NULL
             )
         """)
+        # Legacy one-row-per-tile map, only read to migrate old databases into zone_map
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS zone_tiles (
                 x INTEGER NOT NULL,
@@ -46,27 +90,251 @@ def init_db():
                 PRIMARY KEY (x, y)
             )
         """)
+        # The whole map as one blob of width * height tile bytes, row by row
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS zone_map (
+                zone TEXT PRIMARY KEY,
+                width INTEGER NOT NULL,
+                height INTEGER NOT NULL,
+                tiles BLOB NOT NULL
+            )
+        """)
         conn.commit()
 
+def _start_writer():
+    global _writer_thread
+    if _writer_thread is None and not _writer_stopping.is_set():
+        _writer_thread = threading.Thread(target=_writer_loop, name="db-writer", daemon=True)
+        _writer_thread.start()
+
+def _writer_loop():
+    """Background thread that commits queued writes once per durability window (or sooner when asked)."""
+    while not _writer_stopping.is_set():
+        _flush_requested.wait(DB_FLUSH_INTERVAL)
+        _flush_requested.clear()
+        db_flush()
+
 def db_write(query: str, params: tuple = ()):
-    """Helper function to write to the database."""
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.execute(query, params)
-        conn.commit()
+    """Queues a write; it is committed with the rest of its batch by the writer thread."""
+    started = time.perf_counter() if metrics.enabled else None
+    with _pending_lock:
+        _pending_writes.append((query, params, False))
+        backlog = len(_pending_writes)
+    _start_writer()
+    if backlog >= DB_MAX_PENDING_WRITES:
+        _flush_requested.set()
+    if started is not None:
+        metrics.observe("db_call", time.perf_counter() - started, op="write")
+
+def db_write_many(query: str, params_seq):
+    """Queues the same statement for every parameter tuple in params_seq."""
+    started = time.perf_counter() if metrics.enabled else None
+    with _pending_lock:
+        _pending_writes.append((query, list(params_seq), True))
+    _start_writer()
+    if started is not None:
+        metrics.observe("db_call", time.perf_counter() - started, op="write_many")
+
+def db_write_batch(statements):
+    """Queues (query, params) pairs back to back so they commit together; (query, params_seq, True) runs executemany."""
+    started = time.perf_counter() if metrics.enabled else None
+    entries = []
+    for query, params, *many in statements:
+        many = bool(many and many[0])
+        entries.append((query, list(params) if many else params, many))
+    with _pending_lock:
+        _pending_writes.extend(entries)
+    _start_writer()
+    if started is not None:
+        metrics.observe("db_call", time.perf_counter() - started, op="write_batch")
+
+def db_write_region(x: int, y: int, w: int, h: int, tiles, zone: str = MAP_ZONE):
+    """Queues new contents (w * h tile bytes, row by row) for one rectangle of the stored map blob."""
+    with _pending_lock:
+        _pending_writes.append((None, (zone, x, y, w, h, bytes(tiles)), _REGION))
+    _start_writer()
+
+def db_write_map(tiles, width: int, height: int, zone: str = MAP_ZONE):
+    """Queues the whole map (width * height tile bytes, row by row) to replace the stored one."""
+    db_write("INSERT OR REPLACE INTO zone_map (zone, width, height, tiles) VALUES (?, ?, ?, ?)", (zone, width, height, bytes(tiles)))
+
+def db_request_flush():
+    """Asks the writer thread to commit everything queued so far without waiting for it."""
+    _flush_requested.set()
+
+def db_flush():
+    """Commits every queued write in a single transaction on the calling thread."""
+    global _pending_writes
+    conn = get_connection()
+    # Both the writer thread and the db-io thread flush. Holding the connection lock from the swap
+    # through the commit keeps batches committing in the order they were queued.
+    with _conn_lock:
+        with _pending_lock:
+            batch, _pending_writes = _pending_writes, []
+        if not batch:
+            return
+        started = time.perf_counter()
+        try:
+            with conn:
+                _apply_writes(conn, batch)
+        except sqlite3.Error as e:
+            # One bad statement shouldn't cost us the whole window, so retry them one at a time
+            print(f"Database error while flushing {len(batch)} queued writes, retrying individually: {e}")
+            for entry in batch:
+                try:
+                    with conn:
+                        _apply_writes(conn, [entry])
+                except sqlite3.Error as e:
+                    print(f"Dropping failed write '{entry[0] or 'map region'}': {e}")
+    elapsed = time.perf_counter() - started
+    if metrics.enabled:
+        metrics.observe("db_flush", elapsed)
+        metrics.count("db_statements", len(batch))
+    _flush_stats["flushes"] += 1
+    _flush_stats["statements"] += len(batch)
+    _flush_stats["last_seconds"] = elapsed
+    _flush_stats["max_seconds"] = max(_flush_stats["max_seconds"], elapsed)
+
+def _apply_writes(conn: sqlite3.Connection, batch):
+    regions = [] # A run of consecutive map region changes, applied to the blob together
+    for query, params, kind in batch:
+        if kind == _REGION:
+            regions.append(params)
+            continue
+        if regions:
+            _apply_regions(conn, regions)
+            regions = []
+        if kind:
+            conn.executemany(query, params)
+        else:
+            conn.execute(query, params)
+    if regions:
+        _apply_regions(conn, regions)
+
+def _apply_regions(conn: sqlite3.Connection, changes):
+    """Writes map region changes into the blob row by row: in place where SQLite blob I/O is available (Python 3.11+)."""
+    for zone in {change[0] for change in changes}:
+        row = conn.execute("SELECT rowid, width, height FROM zone_map WHERE zone = ?", (zone,)).fetchone()
+        if row is None:
+            continue
+        rowid, width, height = row
+        # (offset into the blob, bytes) for each region that fits the stored map: full-width regions
+        # are contiguous in the blob, anything narrower is written row by row
+        updates = []
+        for change_zone, x, y, w, h, tiles in changes:
+            if change_zone != zone or x < 0 or y < 0 or x + w > width or y + h > height:
+                continue
+            if w == width:
+                updates.append((y * width, tiles))
+            else:
+                updates.extend(((y + r) * width + x, tiles[r * w:(r + 1) * w]) for r in range(h))
+        if hasattr(conn, "blobopen"):
+            with conn.blobopen("zone_map", "tiles", rowid) as blob:
+                for offset, data in updates:
+                    blob.seek(offset)
+                    blob.write(data)
+        else:
+            tiles = bytearray(conn.execute("SELECT tiles FROM zone_map WHERE rowid = ?", (rowid,)).fetchone()[0])
+            for offset, data in updates:
+                tiles[offset:offset + len(data)] = data
+            conn.execute("UPDATE zone_map SET tiles = ? WHERE rowid = ?", (bytes(tiles), rowid))
+
+def db_flush_stats() -> Dict[str, Any]:
+    """How long the writer's transactions take, plus how many writes are waiting for the next one."""
+    with _pending_lock:
+        pending = len(_pending_writes)
+    return {**_flush_stats, "pending_writes": pending}
+
+def close_db():
+    """Stops the writer thread, flushes anything still queued and closes the connection."""
+    global _conn, _writer_thread
+    _writer_stopping.set()
+    _flush_requested.set()
+    if _writer_thread is not None:
+        _writer_thread.join()
+        _writer_thread = None
+    db_flush()
+    with _conn_lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+    _writer_stopping.clear()
 
 def db_read(query: str, params: tuple = ()) -> List[Any]:
-    """Helper function to read from the database."""
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.execute(query, params)
-        return cursor.fetchall()
+    """Helper function to read from the database. Queued writes are flushed first so reads see them."""
+    started = time.perf_counter() if metrics.enabled else None
+    db_flush()
+    conn = get_connection()
+    with _conn_lock:
+        rows = conn.execute(query, params).fetchall()
+    if started is not None:
+        metrics.observe("db_call", time.perf_counter() - started, op="read") # Including the flush it waited for
+    return rows
+
+class AsyncStore:
+    """Awaitable front end to the helpers above for use inside async code.
+
+    Anything that might touch the disk runs on a dedicated I/O thread so the event loop
+    never waits on SQLite. Writes only queue (see db_write), so they return immediately.
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-io")
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def read(self, query: str, params: tuple = ()) -> List[Any]:
+        return await self._run(db_read, query, params)
+
+    async def write(self, query: str, params: tuple = ()):
+        db_write(query, params)
+
+    async def write_many(self, query: str, params_seq):
+        db_write_many(query, params_seq)
+
+    async def write_region(self, x: int, y: int, w: int, h: int, tiles):
+        db_write_region(x, y, w, h, tiles)
+
+    async def batch(self, statements):
+        """
+        Queues (query, params) pairs so they land in the same transaction. A (query, params_seq, True)
+        triple runs the query once per parameter tuple, like write_many.
+        """
+        db_write_batch(statements)
+
+    def request_flush(self):
+        """Nudges the writer thread to commit what is queued; never waits."""
+        db_request_flush()
+
+    async def flush(self):
+        """Commits everything queued so far and waits until it is on disk."""
+        await self._run(db_flush)
+
+    async def close(self):
+        await self._run(close_db)
+        self._executor.shutdown(wait=True)
+
+def journal_dir() -> str:
+    """Where journal mode keeps this database's snapshots and journal, next to the database file."""
+    return os.path.splitext(DB_FILE)[0] + "_journal"
 
 def load_state_from_db() -> Dict[str, Any]:
-    """Loads the entire game state from the database into memory."""
+    """Loads the entire game state from the database (or in journal mode, the latest snapshot and its journal) into memory."""
+    if PERSISTENCE_MODE not in PERSISTENCE_MODES:
+        raise ValueError(f"Unknown persistence mode '{PERSISTENCE_MODE}', expected one of {PERSISTENCE_MODES}")
+    if PERSISTENCE_MODE == "journal":
+        state = load_world(journal_dir())
+        if state is not None:
+            return state
+        print("No journal snapshot yet; loading the world from the database tables.")
+
     state = {
         "players": {},
         "fauna": {},
         "food": {},
-        "map": []
+        "map": None
     }
     
     fauna_rows = db_read("SELECT * FROM fauna")
@@ -81,26 +349,38 @@ def load_state_from_db() -> Dict[str, Any]:
     for row in food_rows:
         state["food"][row[0]] = {"x": row[1], "y": row[2]}
 
-    map_rows = db_read("SELECT * FROM zone_tiles ORDER BY y, x")
-    if not map_rows:
-        return None 
-
-    map_width = max(row[0] for row in map_rows) + 1
-    map_height = max(row[1] for row in map_rows) + 1
-    game_map = [[0] * map_width for _ in range(map_height)]
-    for x, y, tile_type in map_rows:
-        game_map[y][x] = tile_type
-    state["map"] = game_map
+    map_row = load_map()
+    if map_row is None:
+        return None
+    width, height, tiles = map_row
+    state["map"] = TileMap(width, height, tiles)
     
     return state
 
-def initialize_default_world():
+def load_map(zone: str = MAP_ZONE):
+    """Returns (width, height, tile bytes) for the stored map, migrating a legacy zone_tiles map if needed."""
+    row = db_read("SELECT width, height, tiles FROM zone_map WHERE zone = ?", (zone,))
+    if row:
+        return row[0]
+    map_rows = db_read("SELECT x, y, tile_type FROM zone_tiles")
+    if not map_rows:
+        return None
+    print(f"Migrating {len(map_rows)} zone_tiles rows into a zone_map blob...")
+    width = max(row[0] for row in map_rows) + 1
+    height = max(row[1] for row in map_rows) + 1
+    tiles = bytearray(width * height)
+    for x, y, tile_type in map_rows:
+        tiles[y * width + x] = tile_type
+    db_write_map(tiles, width, height, zone)
+    db_write("DELETE FROM zone_tiles")
+    db_flush()
+    return width, height, bytes(tiles)
+
+def initialize_default_world(width: int = MAP_WIDTH, height: int = MAP_HEIGHT):
     """Populates the database with a default world if it's empty."""
     print("Database is empty. Initializing default world...")
-    game_map = [[0 if random.random() > 0.8 else 1 for _ in range(50)] for _ in range(38)]
-    for y, row in enumerate(game_map):
-        for x, tile_type in enumerate(row):
-            db_write("INSERT INTO zone_tiles (x, y, tile_type) VALUES (?, ?, ?)", (x, y, tile_type))
+    tiles = bytes(0 if random.random() > 0.8 else 1 for _ in range(width * height))
+    db_write_map(tiles, width, height)
     
     fauna_id = "dragon_1"
     fauna_data = {"x": 300, "y": 300, "kind": "dragon", "age_seconds": 0, "stage": "Infant", "is_dead": False, "time_of_death": None, "offspring_count": 0, "death_timer": None, "goal": None}
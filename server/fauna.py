@@ -3,7 +3,8 @@ import uuid
 import random
 import time
 import math
-from db import db_write
+from spatial import SpatialGrid, check_index
+from instrumentation import metrics, lap
 
 # --- Fauna Configuration ---
 FAUNA_AGE_STAGES = {"Infant": 120, "Young": 300, "Adult": 900, "Elderly": 0}
@@ -15,31 +16,81 @@ ELDERLY_MAX_LIFESPAN = 300
 DEAD_REMOVAL_TIME = 60
 IDLE_GOAL_CHANCE = 0.25
 TICK_RATE = 3
+SPATIAL_INDEX_CHECKS = False # Debug: cross-check every food lookup against a brute-force scan
+FAUNA_ENGINE = "dict" # "dict" (one Python dict per dragon) or "vector" (NumPy arrays, see fauna_vector.py)
+FAUNA_PHASES = ("aging", "ai", "movement", "reproduction") # How update_fauna's time is broken down when instrumented
+
+def create_fauna_manager(world_state, store, engine=FAUNA_ENGINE):
+    """Builds the fauna engine picked by FAUNA_ENGINE. Both engines emit the same tick events."""
+    if engine == "vector":
+        from fauna_vector import VectorFaunaEngine, np
+        if np is not None:
+            return VectorFaunaEngine(world_state, store)
+        print("NumPy is not installed; falling back to the dict fauna engine.")
+    elif engine != "dict":
+        raise ValueError(f"Unknown fauna engine '{engine}', expected 'dict' or 'vector'")
+    return FaunaManager(world_state, store)
 
 class FaunaManager:
     """Manages the lifecycle and AI for all fauna in the world."""
 
-    def __init__(self, world_state, broadcast_callback):
+    def __init__(self, world_state, store):
         self.world_state = world_state
-        self.broadcast = broadcast_callback
+        self.store = store
+        self.food_index = SpatialGrid()
+        self.rebuild_food_index()
+
+    # --- Food bookkeeping: every change to world_state["food"] goes through here to keep the index in sync ---
+    def rebuild_food_index(self):
+        self.food_index.clear()
+        for food_id, food in self.world_state["food"].items():
+            self.food_index.insert(food_id, food["x"], food["y"])
+
+    def add_food(self, food_id, food):
+        self.world_state["food"][food_id] = food
+        self.food_index.insert(food_id, food["x"], food["y"])
+
+    def remove_food(self, food_id):
+        """Removes a food item; returns False if it was already gone."""
+        self.food_index.remove(food_id)
+        return self.world_state["food"].pop(food_id, None) is not None
 
-    async def update_fauna(self):
+    def clear_food(self):
+        self.world_state["food"].clear()
+        self.food_index.clear()
+
+    # --- Fauna bookkeeping ---
+    def reset_fauna(self, fauna):
+        """Replaces every fauna in the world with the given {id: data} mapping."""
+        self.world_state["fauna"].clear()
+        self.world_state["fauna"].update(fauna)
+
+    def sync_world_state(self):
+        """Makes world_state["fauna"] current before it is serialized. This engine works on it directly."""
+
+    async def update_fauna(self, delta, dt=TICK_RATE):
         """
         The main update logic for all fauna, called once per game loop tick.
+        dt is the real time in seconds since the previous tick, which is what fauna age by.
+        Changes are recorded into the tick's delta rather than broadcast one by one.
         """
         current_time = time.time()
         fauna_to_add = []
         fauna_to_remove = []
         food_to_remove = []
+        # The phases interleave per dragon, so each one's time is summed across the loop
+        timing = metrics.enabled
+        phase_seconds = dict.fromkeys(FAUNA_PHASES, 0.0)
 
         for fauna_id, fauna in list(self.world_state["fauna"].items()):
             if fauna["is_dead"]:
                 if current_time > fauna["time_of_death"] + DEAD_REMOVAL_TIME:
                     fauna_to_remove.append(fauna_id)
                 continue
+            if timing: mark = time.perf_counter()
 
             # --- Aging and Stage Progression ---
-            fauna["age_seconds"] += TICK_RATE
+            fauna["age_seconds"] += dt
             previous_stage = fauna["stage"]
             if fauna["stage"] == "Infant" and fauna["age_seconds"] > FAUNA_AGE_STAGES["Infant"]: fauna["stage"] = "Young"
             elif fauna["stage"] == "Young" and fauna["age_seconds"] > FAUNA_AGE_STAGES["Young"]: fauna["stage"] = "Adult"
@@ -48,22 +99,23 @@ class FaunaManager:
                 fauna["death_timer"] = current_time + random.randint(ELDERLY_MIN_LIFESPAN, ELDERLY_MAX_LIFESPAN)
             
             if fauna["stage"] != previous_stage:
-                db_write("UPDATE fauna SET stage = ?, age_seconds = ?, death_timer = ? WHERE id = ?", (fauna["stage"], fauna["age_seconds"], fauna.get("death_timer"), fauna_id))
-                await self.broadcast(json.dumps({"type": "fauna_stage_changed", "fauna_id": fauna_id, "data": fauna}))
+                await self.store.write("UPDATE fauna SET stage = ?, age_seconds = ?, death_timer = ? WHERE id = ?", (fauna["stage"], fauna["age_seconds"], fauna.get("death_timer"), fauna_id))
+                delta.fauna_stage_changed(fauna_id, fauna)
+            if timing: mark = lap(phase_seconds, "aging", mark)
 
             # --- Goal-Oriented AI Logic ---
             if fauna["stage"] == "Young" and self.world_state["food"]:
-                nearest_food_id, nearest_food_pos, min_dist = None, None, float('inf')
-                for food_id, food_pos in self.world_state["food"].items():
-                    dist = math.hypot(fauna['x'] - food_pos['x'], fauna['y'] - food_pos['y'])
-                    if dist < min_dist:
-                        min_dist, nearest_food_id, nearest_food_pos = dist, food_id, food_pos
-                if nearest_food_pos:
-                    fauna["goal"] = {"type": "seek_food", "x": nearest_food_pos["x"], "y": nearest_food_pos["y"], "food_id": nearest_food_id}
+                if SPATIAL_INDEX_CHECKS:
+                    check_index(self.food_index, self.world_state["food"], fauna['x'], fauna['y'])
+                nearest = self.food_index.nearest(fauna['x'], fauna['y'])
+                if nearest:
+                    nearest_food_id, food_x, food_y, _ = nearest
+                    fauna["goal"] = {"type": "seek_food", "x": food_x, "y": food_y, "food_id": nearest_food_id}
             
             elif not fauna.get("goal") and fauna["stage"] in ["Adult", "Elderly"]:
                 if random.random() < IDLE_GOAL_CHANCE:
                     fauna["goal"] = {"type": "wander", "x": random.randint(16, 784), "y": random.randint(16, 584)}
+            if timing: mark = lap(phase_seconds, "ai", mark)
 
             # --- Movement based on Goal ---
             if fauna.get("goal"):
@@ -75,8 +127,8 @@ class FaunaManager:
                         food_to_remove.append(goal["food_id"])
                         if random.random() < 0.25:
                             fauna["stage"] = "Adult"
-                            db_write("UPDATE fauna SET stage = ? WHERE id = ?", (fauna["stage"], fauna_id))
-                            await self.broadcast(json.dumps({"type": "fauna_stage_changed", "fauna_id": fauna_id, "data": fauna}))
+                            await self.store.write("UPDATE fauna SET stage = ? WHERE id = ?", (fauna["stage"], fauna_id))
+                            delta.fauna_stage_changed(fauna_id, fauna)
                     fauna["goal"] = None
                 else:
                     speed = 16 * (1 if fauna["stage"] == "Elderly" else 2)
@@ -84,8 +136,9 @@ class FaunaManager:
                     elif goal_x < fauna['x']: fauna['x'] -= speed
                     if goal_y > fauna['y']: fauna['y'] += speed
                     elif goal_y < fauna['y']: fauna['y'] -= speed
-                    db_write("UPDATE fauna SET x=?, y=?, goal=? WHERE id=?", (fauna['x'], fauna['y'], json.dumps(fauna['goal']), fauna_id))
-                    await self.broadcast(json.dumps({"type": "fauna_moved", "fauna_id": fauna_id, "data": fauna}))
+                    await self.store.write("UPDATE fauna SET x=?, y=?, goal=? WHERE id=?", (fauna['x'], fauna['y'], json.dumps(fauna['goal']), fauna_id))
+                    delta.fauna_moved_to(fauna_id, fauna)
+            if timing: mark = lap(phase_seconds, "movement", mark)
 
             # --- Reproduction & Death ---
             if fauna["stage"] == "Adult" and fauna["offspring_count"] < MAX_OFFSPRING:
@@ -98,9 +151,12 @@ class FaunaManager:
                         new_id = f"dragon_{int(time.time())}_{uuid.uuid4().hex[:8]}"
                         new_data = {"x": fauna["x"], "y": fauna["y"], "kind": "dragon", "age_seconds": 0, "stage": "Infant", "is_dead": False, "time_of_death": None, "offspring_count": 0, "death_timer": None, "goal": None}
                         fauna_to_add.append((new_id, new_data))
+                        # Queueing can still fail here; errors committing the batch are reported by the writer thread
                         try:
-                            db_write("INSERT INTO fauna (id, kind, x, y, age_seconds, stage, is_dead, offspring_count, goal) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (new_id, new_data["kind"], new_data["x"], new_data["y"], 0, "Infant", False, 0, None))
-                            db_write("UPDATE fauna SET offspring_count = ? WHERE id = ?", (fauna["offspring_count"], fauna_id))
+                            await self.store.batch([
+                                ("INSERT INTO fauna (id, kind, x, y, age_seconds, stage, is_dead, offspring_count, goal) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (new_id, new_data["kind"], new_data["x"], new_data["y"], 0, "Infant", False, 0, None)),
+                                ("UPDATE fauna SET offspring_count = ? WHERE id = ?", (fauna["offspring_count"], fauna_id)),
+                            ])
                         except Exception as e:
                             print(f"Database error while spawning fauna: {e}")
                             # Remove from fauna_to_add if database write failed
@@ -108,7 +164,11 @@ class FaunaManager:
             
             if fauna["stage"] == "Elderly" and current_time > fauna.get("death_timer", float('inf')):
                 fauna["is_dead"], fauna["time_of_death"] = True, current_time
-                db_write("UPDATE fauna SET is_dead = ?, time_of_death = ? WHERE id = ?", (True, current_time, fauna_id))
-                await self.broadcast(json.dumps({"type": "fauna_died", "fauna_id": fauna_id, "data": fauna}))
-        
+                await self.store.write("UPDATE fauna SET is_dead = ?, time_of_death = ? WHERE id = ?", (True, current_time, fauna_id))
+                delta.fauna_died(fauna_id, fauna)
+            if timing: lap(phase_seconds, "reproduction", mark)
+
+        if timing:
+            for phase, seconds in phase_seconds.items():
+                metrics.observe("fauna_phase", seconds, engine="dict", phase=phase)
         return fauna_to_add, fauna_to_remove, food_to_remove
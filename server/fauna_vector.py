@@ -0,0 +1,298 @@
+"""
+Struct-of-arrays fauna engine.
+
+Every dragon is a row in a set of NumPy arrays (position, age, stage code, goal, timers...)
+and a tick advances all of them with a handful of vectorized operations. Only fauna that
+actually produce an event are copied back into their world_state["fauna"] dict, so the
+per-dragon Python cost is paid for what changed rather than for everything alive.
+
+Select it with FAUNA_ENGINE = "vector" in fauna.py. NumPy is optional; without it the
+server falls back to the dict engine.
+"""
+import json
+import time
+import uuid
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from fauna import (
+    FaunaManager, FAUNA_AGE_STAGES, ADULT_SPAWN_CHANCE, REPRODUCTION_COOLDOWN, MAX_OFFSPRING,
+    ELDERLY_MIN_LIFESPAN, ELDERLY_MAX_LIFESPAN, DEAD_REMOVAL_TIME, IDLE_GOAL_CHANCE, TICK_RATE, FAUNA_PHASES,
+)
+from instrumentation import metrics, lap
+
+# --- Codes ---
+STAGES = ("Infant", "Young", "Adult", "Elderly")
+STAGE_CODES = {name: code for code, name in enumerate(STAGES)}
+INFANT, YOUNG, ADULT, ELDERLY = range(4)
+GOAL_NONE, GOAL_WANDER, GOAL_SEEK_FOOD = 0, 1, 2
+GOAL_TYPES = {"wander": GOAL_WANDER, "seek_food": GOAL_SEEK_FOOD}
+
+BRUTE_FORCE_FOOD_LIMIT = 512 # Above this many food items, nearest-food lookups go through the spatial grid
+DISTANCE_CHUNK = 1 << 20 # Max fauna x food distances computed at once
+
+
+class VectorFaunaEngine(FaunaManager):
+    """Drop-in replacement for FaunaManager that keeps fauna state in NumPy arrays."""
+
+    def __init__(self, world_state, store, seed=None):
+        if np is None:
+            raise ImportError("The vector fauna engine needs NumPy (pip install numpy)")
+        super().__init__(world_state, store)
+        self.rng = np.random.default_rng(seed)
+        self._load_all()
+
+    # --- Array bookkeeping ---
+    def _load_all(self):
+        self.ids = []
+        self.index = {}
+        self.x = np.zeros(0)
+        self.y = np.zeros(0)
+        self.age = np.zeros(0)
+        self.stage = np.zeros(0, dtype=np.int8)
+        self.dead = np.zeros(0, dtype=bool)
+        self.time_of_death = np.zeros(0)
+        self.offspring = np.zeros(0, dtype=np.int16)
+        self.death_timer = np.zeros(0)
+        self.last_repro = np.zeros(0)
+        self.goal_kind = np.zeros(0, dtype=np.int8)
+        self.goal_x = np.zeros(0)
+        self.goal_y = np.zeros(0)
+        self.goal_food = []
+        self._append(list(self.world_state["fauna"].items()))
+
+    def _append(self, items):
+        if not items:
+            return
+        records = [fauna for _, fauna in items]
+        goals = [fauna.get("goal") or {} for fauna in records]
+        self.x = np.concatenate([self.x, [float(f["x"]) for f in records]])
+        self.y = np.concatenate([self.y, [float(f["y"]) for f in records]])
+        self.age = np.concatenate([self.age, [float(f["age_seconds"]) for f in records]])
+        self.stage = np.concatenate([self.stage, np.array([STAGE_CODES.get(f["stage"], INFANT) for f in records], dtype=np.int8)])
+        self.dead = np.concatenate([self.dead, np.array([bool(f["is_dead"]) for f in records], dtype=bool)])
+        self.time_of_death = np.concatenate([self.time_of_death, [f["time_of_death"] if f["time_of_death"] is not None else np.nan for f in records]])
+        self.offspring = np.concatenate([self.offspring, np.array([f["offspring_count"] for f in records], dtype=np.int16)])
+        self.death_timer = np.concatenate([self.death_timer, [f["death_timer"] if f.get("death_timer") is not None else np.inf for f in records]])
+        self.last_repro = np.concatenate([self.last_repro, [f.get("last_repro_attempt", 0) for f in records]])
+        self.goal_kind = np.concatenate([self.goal_kind, np.array([GOAL_TYPES.get(g.get("type"), GOAL_NONE) for g in goals], dtype=np.int8)])
+        self.goal_x = np.concatenate([self.goal_x, [g.get("x", 0) for g in goals]])
+        self.goal_y = np.concatenate([self.goal_y, [g.get("y", 0) for g in goals]])
+        self.goal_food.extend(g.get("food_id") for g in goals)
+        for fauna_id, _ in items:
+            self.index[fauna_id] = len(self.ids)
+            self.ids.append(fauna_id)
+
+    def _drop(self, gone):
+        keep = np.ones(len(self.ids), dtype=bool)
+        keep[[self.index[fauna_id] for fauna_id in gone]] = False
+        for name in ("x", "y", "age", "stage", "dead", "time_of_death", "offspring", "death_timer",
+                     "last_repro", "goal_kind", "goal_x", "goal_y"):
+            setattr(self, name, getattr(self, name)[keep])
+        kept = np.flatnonzero(keep)
+        self.ids = [self.ids[i] for i in kept]
+        self.goal_food = [self.goal_food[i] for i in kept]
+        self.index = {fauna_id: i for i, fauna_id in enumerate(self.ids)}
+
+    def _sync_membership(self):
+        """Picks up fauna the game loop added to or removed from world_state since the last tick."""
+        current = self.world_state["fauna"]
+        gone = self.index.keys() - current.keys()
+        if gone:
+            self._drop(gone)
+        new = current.keys() - self.index.keys()
+        if new:
+            self._append([(fauna_id, current[fauna_id]) for fauna_id in current if fauna_id in new])
+
+    def _goals(self, rows):
+        goals = []
+        for i, kind, gx, gy in zip(rows, self.goal_kind[rows].tolist(), self.goal_x[rows].tolist(), self.goal_y[rows].tolist()):
+            if kind == GOAL_NONE:
+                goals.append(None)
+            elif kind == GOAL_WANDER:
+                goals.append({"type": "wander", "x": int(gx), "y": int(gy)})
+            else:
+                goals.append({"type": "seek_food", "x": gx, "y": gy, "food_id": self.goal_food[i]})
+        return goals
+
+    def _write_back(self, rows, positions_only=False):
+        """Copies the given rows into their world_state dicts and returns those dicts."""
+        records = [self.world_state["fauna"][self.ids[i]] for i in rows]
+        for fauna, x, y, goal in zip(records, self.x[rows].tolist(), self.y[rows].tolist(), self._goals(rows)):
+            fauna["x"], fauna["y"], fauna["goal"] = x, y, goal
+        if positions_only:
+            return records
+        columns = zip(
+            records, self.age[rows].tolist(), self.stage[rows].tolist(), self.dead[rows].tolist(),
+            self.time_of_death[rows].tolist(), self.offspring[rows].tolist(), self.death_timer[rows].tolist(),
+            self.last_repro[rows].tolist(),
+        )
+        for fauna, age, stage, dead, time_of_death, offspring, death_timer, last_repro in columns:
+            fauna["age_seconds"] = age
+            fauna["stage"] = STAGES[stage]
+            fauna["is_dead"] = dead
+            fauna["time_of_death"] = None if time_of_death != time_of_death else time_of_death # NaN means alive
+            fauna["offspring_count"] = offspring
+            fauna["death_timer"] = None if death_timer == np.inf else death_timer
+            if last_repro:
+                fauna["last_repro_attempt"] = last_repro
+        return records
+
+    # --- FaunaManager interface ---
+    def reset_fauna(self, fauna):
+        super().reset_fauna(fauna)
+        self._load_all()
+
+    def sync_world_state(self):
+        self._sync_membership()
+        self._write_back(np.arange(len(self.ids)))
+
+    def _nearest_food(self, rows):
+        """Returns [(food_id, x, y)] with the nearest food for each row, matching the dict engine's scan."""
+        food = self.world_state["food"]
+        if len(food) > BRUTE_FORCE_FOOD_LIMIT:
+            results = []
+            for i in rows:
+                food_id, fx, fy, _ = self.food_index.nearest(self.x[i], self.y[i])
+                results.append((food_id, fx, fy))
+            return results
+        food_ids = list(food)
+        fx = np.array([food[food_id]["x"] for food_id in food_ids], dtype=float)
+        fy = np.array([food[food_id]["y"] for food_id in food_ids], dtype=float)
+        best = np.empty(len(rows), dtype=np.intp)
+        chunk = max(1, DISTANCE_CHUNK // len(food_ids))
+        for start in range(0, len(rows), chunk):
+            part = rows[start:start + chunk]
+            dist = np.hypot(self.x[part, None] - fx[None, :], self.y[part, None] - fy[None, :])
+            best[start:start + chunk] = np.argmin(dist, axis=1) # First minimum, like the dict engine's strict <
+        return [(food_ids[j], food[food_ids[j]]["x"], food[food_ids[j]]["y"]) for j in best]
+
+    async def update_fauna(self, delta, dt=TICK_RATE):
+        """Advances every fauna by one tick of dt seconds. Returns the same (to_add, to_remove, food_to_remove) as FaunaManager."""
+        self._sync_membership()
+        current_time = time.time()
+        fauna_to_add, fauna_to_remove, food_to_remove = [], [], []
+        updated = [] # Rows that went into the delta as whole records
+        n = len(self.ids)
+        if n == 0:
+            return fauna_to_add, fauna_to_remove, food_to_remove
+        stage = self.stage
+        alive = ~self.dead
+
+        fauna_to_remove = [self.ids[i] for i in np.flatnonzero(self.dead & (current_time > self.time_of_death + DEAD_REMOVAL_TIME))]
+        timing = metrics.enabled
+        phase_seconds = dict.fromkeys(FAUNA_PHASES, 0.0)
+        if timing: mark = time.perf_counter()
+
+        # --- Aging and Stage Progression ---
+        self.age[alive] += dt
+        to_young = alive & (stage == INFANT) & (self.age > FAUNA_AGE_STAGES["Infant"])
+        to_adult = alive & (stage == YOUNG) & (self.age > FAUNA_AGE_STAGES["Young"])
+        to_elderly = alive & (stage == ADULT) & (self.age > FAUNA_AGE_STAGES["Adult"])
+        stage[to_young] = YOUNG
+        stage[to_adult] = ADULT
+        stage[to_elderly] = ELDERLY
+        self.death_timer[to_elderly] = current_time + self.rng.integers(ELDERLY_MIN_LIFESPAN, ELDERLY_MAX_LIFESPAN + 1, int(to_elderly.sum()))
+        staged = np.flatnonzero(to_young | to_adult | to_elderly)
+        updated.extend(staged.tolist())
+        if staged.size:
+            rows = []
+            for i, fauna in zip(staged, self._write_back(staged)):
+                rows.append((fauna["stage"], fauna["age_seconds"], fauna["death_timer"], self.ids[i]))
+                delta.fauna_stage_changed(self.ids[i], fauna)
+            await self.store.write_many("UPDATE fauna SET stage = ?, age_seconds = ?, death_timer = ? WHERE id = ?", rows)
+        if timing: mark = lap(phase_seconds, "aging", mark)
+
+        # --- Goal-Oriented AI Logic ---
+        if self.world_state["food"]:
+            hungry = np.flatnonzero(alive & (stage == YOUNG))
+            if hungry.size:
+                targets = self._nearest_food(hungry)
+                for i, (food_id, _, _) in zip(hungry, targets):
+                    self.goal_food[i] = food_id
+                self.goal_kind[hungry] = GOAL_SEEK_FOOD
+                self.goal_x[hungry] = [fx for _, fx, _ in targets]
+                self.goal_y[hungry] = [fy for _, _, fy in targets]
+        idle = np.flatnonzero(alive & (self.goal_kind == GOAL_NONE) & (stage >= ADULT) & (self.rng.random(n) < IDLE_GOAL_CHANCE))
+        if idle.size:
+            self.goal_kind[idle] = GOAL_WANDER
+            self.goal_x[idle] = self.rng.integers(16, 785, idle.size)
+            self.goal_y[idle] = self.rng.integers(16, 585, idle.size)
+            for i in idle:
+                self.goal_food[i] = None
+        if timing: mark = lap(phase_seconds, "ai", mark)
+
+        # --- Movement based on Goal ---
+        has_goal = alive & (self.goal_kind != GOAL_NONE)
+        dx = self.goal_x - self.x
+        dy = self.goal_y - self.y
+        near = np.hypot(dx, dy) < 20
+        arrived = np.flatnonzero(has_goal & near)
+        for i in arrived:
+            food_id = self.goal_food[i]
+            if self.goal_kind[i] == GOAL_SEEK_FOOD and food_id not in food_to_remove:
+                food_to_remove.append(food_id)
+                if self.rng.random() < 0.25:
+                    stage[i] = ADULT
+                    await self.store.write("UPDATE fauna SET stage = ? WHERE id = ?", ("Adult", self.ids[i]))
+                    delta.fauna_stage_changed(self.ids[i], self._write_back([i])[0])
+                    updated.append(i)
+            self.goal_kind[i] = GOAL_NONE
+            self.goal_food[i] = None
+        stepping = has_goal & ~near
+        speed = np.where(stage == ELDERLY, 16, 32)
+        self.x[stepping] += (np.sign(dx) * speed)[stepping]
+        self.y[stepping] += (np.sign(dy) * speed)[stepping]
+        moved = np.flatnonzero(stepping)
+        if moved.size:
+            rows = []
+            for i, fauna in zip(moved, self._write_back(moved, positions_only=True)):
+                rows.append((fauna["x"], fauna["y"], json.dumps(fauna["goal"]), self.ids[i]))
+                delta.fauna_moved_to(self.ids[i], fauna)
+            await self.store.write_many("UPDATE fauna SET x=?, y=?, goal=? WHERE id=?", rows)
+        if timing: mark = lap(phase_seconds, "movement", mark)
+
+        # --- Reproduction & Death ---
+        fertile = alive & (stage == ADULT) & (self.offspring < MAX_OFFSPRING) & (current_time > self.last_repro + REPRODUCTION_COOLDOWN)
+        self.last_repro[fertile] = current_time
+        breeding = np.flatnonzero(fertile & (self.rng.random(n) < ADULT_SPAWN_CHANCE))
+        if breeding.size:
+            self.offspring[breeding] += 1
+            spawn_rows, parent_rows = [], []
+            for i in breeding:
+                new_id = f"dragon_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+                new_data = {"x": self.x[i].item(), "y": self.y[i].item(), "kind": "dragon", "age_seconds": 0, "stage": "Infant", "is_dead": False, "time_of_death": None, "offspring_count": 0, "death_timer": None, "goal": None}
+                fauna_to_add.append((new_id, new_data))
+                spawn_rows.append((new_id, new_data["kind"], new_data["x"], new_data["y"], 0, "Infant", False, 0, None))
+                parent_rows.append((int(self.offspring[i]), self.ids[i]))
+            try:
+                await self.store.batch([
+                    ("INSERT INTO fauna (id, kind, x, y, age_seconds, stage, is_dead, offspring_count, goal) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", spawn_rows, True),
+                    ("UPDATE fauna SET offspring_count = ? WHERE id = ?", parent_rows, True),
+                ])
+            except Exception as e:
+                print(f"Database error while spawning {len(spawn_rows)} fauna: {e}")
+                fauna_to_add = []
+
+        dying = np.flatnonzero(alive & (stage == ELDERLY) & (current_time > self.death_timer))
+        if dying.size:
+            self.dead[dying] = True
+            self.time_of_death[dying] = current_time
+            for i, fauna in zip(dying, self._write_back(dying)):
+                delta.fauna_died(self.ids[i], fauna)
+            updated.extend(dying.tolist())
+            await self.store.write_many("UPDATE fauna SET is_dead = ?, time_of_death = ? WHERE id = ?", [(True, current_time, self.ids[i]) for i in dying])
+
+        # The dict engine's records are live, so its frame carries each updated fauna as it ended the tick
+        # (goal cleared after eating, offspring born later in the tick); copy the later phases back to match
+        if updated:
+            self._write_back(np.unique(updated))
+
+        if timing:
+            lap(phase_seconds, "reproduction", mark)
+            for phase, seconds in phase_seconds.items():
+                metrics.observe("fauna_phase", seconds, engine="vector", phase=phase)
+        return fauna_to_add, fauna_to_remove, food_to_remove
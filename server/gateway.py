@@ -0,0 +1,184 @@
+"""
+Front gateway for the sharded server: `uvicorn gateway:app` instead of `uvicorn main:app`.
+
+The gateway owns every websocket and starts one worker process per zone (zones.py). Client
+messages are forwarded to the player's current zone, and whatever the zone sends back goes out
+through the same per-client queue the single-process server uses. When a player_move takes a
+player past a zone edge, the gateway closes their session in the old zone and rejoins them to the
+neighbouring zone at the matching edge, so the client simply receives a fresh world.
+"""
+
+import json
+import time
+import uuid
+import asyncio
+import threading
+from multiprocessing import get_context
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi.middleware.cors import CORSMiddleware
+
+import db
+from db import AsyncStore
+from connections import ClientConnection, SLOW_CONSUMER_POLICY, OUTBOUND_QUEUE_SIZE
+from zones import start_zones, handoff_target, pump, all_zone_ids
+
+# --- Gateway Configuration ---
+GATEWAY_DB_FILE = "project_arbor_gateway.db" # Which zone each player was last in
+DEFAULT_ZONE = all_zone_ids()[0]
+HANDOFF_GRACE = 1.0 # Seconds after a handoff during which out-of-zone moves are stale and dropped
+
+db.DB_FILE = GATEWAY_DB_FILE
+
+app = FastAPI()
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+
+store = AsyncStore()
+zones = {}
+sessions = {} # zone session id -> GatewaySession
+active_names = set()
+
+
+class GatewaySession:
+    """One connected player: their websocket's outbound queue and which zone session they are in."""
+
+    def __init__(self, websocket: WebSocket, name: str, join_request: dict):
+        self.websocket = websocket
+        self.name = name
+        self.join_request = join_request
+        self.zone = None
+        self.session = None
+        self.handoff_at = 0.0
+        self.handoffs = 0
+        self.client = ClientConnection(websocket, name, SLOW_CONSUMER_POLICY, OUTBOUND_QUEUE_SIZE)
+        self.client.start(lambda _: self.client.close_after_drain())
+
+    def enter(self, zone: str, handoff=None):
+        """Joins the player to a zone, leaving the one they were in first."""
+        if self.session is not None:
+            zones[self.zone].send("close", self.session)
+            sessions.pop(self.session, None)
+        self.zone = zone
+        self.session = uuid.uuid4().hex
+        sessions[self.session] = self
+        join_request = dict(self.join_request, handoff=handoff) if handoff else self.join_request
+        zones[zone].send("open", self.session)
+        zones[zone].send("recv", self.session, json.dumps(join_request))
+
+    def leave(self):
+        if self.session is not None:
+            zones[self.zone].send("close", self.session)
+            sessions.pop(self.session, None)
+            self.session = None
+        if self.client.sender_task is not None:
+            self.client.sender_task.cancel()
+
+
+def _dispatch(message):
+    """Handles one message a zone sent towards a client."""
+    op, session_id = message[0], message[1]
+    session = sessions.get(session_id)
+    if session is None:
+        return # From a session the player has already been handed off from
+    if op == "send":
+        session.client.enqueue(message[2])
+    elif op == "close":
+        sessions.pop(session_id, None)
+        session.session = None
+        session.client.close_after_drain()
+
+
+async def _route_zone_messages(outbox_items: asyncio.Queue):
+    while True:
+        _dispatch(await outbox_items.get())
+
+
+async def _player_zone(name: str) -> str:
+    rows = await store.read("SELECT zone FROM player_zones WHERE name = ?", (name,))
+    return rows[0][0] if rows and rows[0][0] in zones else DEFAULT_ZONE
+
+
+@app.on_event("startup")
+async def startup_event():
+    """Creates the gateway table and starts every zone worker plus the thread that reads their output."""
+    await store.write("CREATE TABLE IF NOT EXISTS player_zones (name TEXT PRIMARY KEY, zone TEXT NOT NULL)")
+    await store.flush()
+    context = get_context("spawn")
+    outbox = context.Queue()
+    zones.update(start_zones(outbox, context))
+    outbox_items = asyncio.Queue()
+    threading.Thread(target=pump, args=(outbox, asyncio.get_running_loop(), outbox_items), name="gateway-bus", daemon=True).start()
+    asyncio.create_task(_route_zone_messages(outbox_items))
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stops every zone (each flushes its own database) and then the gateway's store."""
+    for zone in zones.values():
+        await asyncio.get_running_loop().run_in_executor(None, zone.stop)
+    await store.close()
+
+
+def _queue_stats(client: ClientConnection) -> dict:
+    # Protocol, sync and interest state live in the zone; the gateway only runs the outbound queue
+    return {key: value for key, value in client.stats().items() if key in ("queue_depth", "max_queue_depth", "sent", "dropped", "coalesced")}
+
+
+@app.get("/metrics/zones")
+async def zone_metrics():
+    """Which zone workers are alive and how many players each is serving."""
+    players = {}
+    for session in sessions.values():
+        players.setdefault(session.zone, []).append(session.name)
+    return {
+        "zones": {zone: {**process.stats(), "players": players.get(zone, [])} for zone, process in zones.items()},
+        "clients": {session.name: {**_queue_stats(session.client), "zone": session.zone, "handoffs": session.handoffs} for session in sessions.values()},
+    }
+
+
+@app.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    await websocket.accept()
+    try:
+        message = json.loads(await websocket.receive_text())
+    except WebSocketDisconnect:
+        return
+    if message.get("type") != "player_join_request":
+        await websocket.close()
+        return
+    name = message.get("name", "Anon")
+    # Zones only know their own players, so names are checked here across all of them
+    if name in active_names:
+        await websocket.send_text(json.dumps({"type": "error", "reason": "name_taken"}))
+        await websocket.close()
+        return
+    message.pop("handoff", None)
+    active_names.add(name)
+    session = GatewaySession(websocket, name, message)
+    try:
+        session.enter(await _player_zone(name))
+        while True:
+            text = await websocket.receive_text()
+            if session.session is None:
+                continue # The zone closed this player; the socket is closing
+            message = json.loads(text)
+            if message.get("type") == "player_move":
+                target = handoff_target(session.zone, message.get("x", 0), message.get("y", 0))
+                if target is not None:
+                    if time.monotonic() - session.handoff_at < HANDOFF_GRACE:
+                        continue # Sent before the client saw the last handoff
+                    zone, x, y = target
+                    print(f"Handing {name} off from zone {session.zone} to zone {zone}")
+                    session.enter(zone, handoff={"x": x, "y": y})
+                    session.handoff_at = time.monotonic()
+                    session.handoffs += 1
+                    await store.write("INSERT OR REPLACE INTO player_zones (name, zone) VALUES (?, ?)", (name, zone))
+                    store.request_flush()
+                    continue
+            zones[session.zone].send("recv", session.session, text)
+    except WebSocketDisconnect:
+        print(f"Player {name} disconnected from the gateway.")
+    except Exception as e:
+        print(f"An error occurred for player {name} at the gateway: {e}")
+    finally:
+        session.leave()
+        active_names.discard(name)
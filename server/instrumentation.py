@@ -0,0 +1,172 @@
+"""
+Hot-path instrumentation and a sampling profiler.
+
+With INSTRUMENTATION on, the fauna engines time their phases, db.py times its helpers, the
+connection manager times broadcasts and counts outbound bytes, and encode_message times
+json.dumps per message type. GET /metrics renders everything as Prometheus text. Off, every probe
+is a single `metrics.enabled` check.
+
+SamplingProfiler snapshots one thread's stack every PROFILE_SAMPLE_INTERVAL and writes the counts
+in the folded format flamegraph.pl and speedscope read: one "outer;inner;leaf count" line per stack.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from collections import Counter
+
+# --- Instrumentation Configuration ---
+INSTRUMENTATION = False # Can also be switched at runtime with POST /debug/instrumentation
+METRICS_PREFIX = "arbor"
+PROFILE_DIR = "profiles"
+PROFILE_SAMPLE_INTERVAL = 0.005 # Seconds between stack samples
+DEFAULT_PROFILE_TICKS = 20
+MAX_PROFILE_TICKS = 600 # Longer requests are clamped; the profiler holds every distinct stack until it stops
+DEBUG_CLIENTS = ("127.0.0.1", "::1") # Addresses allowed to call the /debug routes
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """Timings (sum and count, as Prometheus summaries) and counters, each keyed by name and labels."""
+
+    def __init__(self, enabled: bool = INSTRUMENTATION):
+        self.enabled = enabled
+        self.timings = {} # (name, labels) -> [seconds, count]
+        self.counters = {} # (name, labels) -> value
+        self._lock = threading.Lock() # db.py records from its I/O threads
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            timing = self.timings.get(key)
+            if timing is None:
+                self.timings[key] = [seconds, 1]
+            else:
+                timing[0] += seconds
+                timing[1] += 1
+
+    def count(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def timer(self, name: str, **labels):
+        """Context manager timing its body into name: `with metrics.timer("broadcast", path="delta"): ...`"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, labels)
+
+    def reset(self):
+        with self._lock:
+            self.timings.clear()
+            self.counters.clear()
+
+    def render(self, gauges=()) -> str:
+        """Prometheus text exposition. gauges are extra (name, labels dict, value) samples, e.g. queue depths."""
+        families = {}
+        with self._lock:
+            for (name, labels), (seconds, count) in self.timings.items():
+                family = families.setdefault(f"{METRICS_PREFIX}_{name}_seconds", ("summary", []))[1]
+                family.append(("_sum", labels, seconds))
+                family.append(("_count", labels, count))
+            for (name, labels), value in self.counters.items():
+                families.setdefault(f"{METRICS_PREFIX}_{name}_total", ("counter", []))[1].append(("", labels, value))
+        for name, labels, value in gauges:
+            families.setdefault(f"{METRICS_PREFIX}_{name}", ("gauge", []))[1].append(("", tuple(sorted(labels.items())), value))
+        lines = []
+        for family, (kind, samples) in sorted(families.items()):
+            lines.append(f"# TYPE {family} {kind}")
+            for suffix, labels, value in samples:
+                label_text = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+                lines.append(f"{family}{suffix}{{{label_text}}} {value}" if label_text else f"{family}{suffix} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class _Timer:
+    def __init__(self, metrics: Metrics, name: str, labels: dict):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics()
+
+
+def lap(totals: dict, phase: str, since: float) -> float:
+    """Adds the time since `since` to totals[phase] and returns now, for timing phases that interleave in a loop."""
+    now = time.perf_counter()
+    totals[phase] += now - since
+    return now
+
+
+def encode_message(message: dict, **kwargs) -> str:
+    """json.dumps for an outbound message, timed per message type when instrumentation is on."""
+    if not metrics.enabled:
+        return json.dumps(message, **kwargs)
+    started = time.perf_counter()
+    text = json.dumps(message, **kwargs)
+    metrics.observe("encode", time.perf_counter() - started, message_type=message.get("type"), encoding="json")
+    return text
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack on a background thread until stopped."""
+
+    def __init__(self, thread_id: int = None, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
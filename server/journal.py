@@ -0,0 +1,279 @@
+"""
+Snapshot + journal persistence (db.PERSISTENCE_MODE = "journal").
+
+Instead of a row write for every fauna move, the world is saved as:
+
+    snapshot-<seq>.json.gz   the whole world (fauna, food, map) every SNAPSHOT_INTERVAL seconds
+    journal-<seq>.jsonl      one line per tick after that snapshot: what the tick's delta recorded
+                             (spawned/updated fauna records, moves, removals), dropped food and the
+                             map regions that changed
+
+Loading reads the newest snapshot and replays its journal. Lines are appended sequentially on a
+background thread and fsynced every JOURNAL_FSYNC_INTERVAL. After each snapshot, older snapshots and
+segments beyond JOURNAL_KEEP_SNAPSHOTS are deleted on the same thread.
+
+Replay is approximate by design: ages advance by each tick's dt, and changes that never reach the
+delta (a parent's offspring_count, goals) are only as fresh as the last snapshot. Players are not journaled; their positions stay in the users table.
+"""
+
+import os
+import re
+import json
+import gzip
+import time
+import base64
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from tilemap import TileMap
+
+# --- Journal Configuration ---
+SNAPSHOT_INTERVAL = 300.0 # Seconds between full snapshots
+JOURNAL_FSYNC_INTERVAL = 1.0 # Durability window for journal lines, like DB_FLUSH_INTERVAL for rows
+JOURNAL_KEEP_SNAPSHOTS = 2 # Snapshots (and their segments) kept; raise it to keep more replayable history
+
+_SNAPSHOT_FILE = re.compile(r"snapshot-(\d+)\.json\.gz$")
+
+
+def snapshot_path(directory: str, seq: int) -> str:
+    return os.path.join(directory, f"snapshot-{seq:08d}.json.gz")
+
+
+def segment_path(directory: str, seq: int) -> str:
+    return os.path.join(directory, f"journal-{seq:08d}.jsonl")
+
+
+def snapshot_seqs(directory: str) -> list:
+    """Sequence numbers of the complete snapshots in a journal directory, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(int(match.group(1)) for match in map(_SNAPSHOT_FILE.match, os.listdir(directory)) if match)
+
+
+# --- Loading ---
+def read_snapshot(directory: str, seq: int) -> dict:
+    """The world_state a snapshot holds (players empty)."""
+    with gzip.open(snapshot_path(directory, seq), "rt") as f:
+        snapshot = json.load(f)
+    tile_map = snapshot["map"]
+    return {
+        "players": {},
+        "fauna": snapshot["fauna"],
+        "food": snapshot["food"],
+        "map": TileMap(tile_map["width"], tile_map["height"], base64.b64decode(tile_map["tiles"])),
+    }
+
+
+def replay_segment(state: dict, path: str) -> int:
+    """Applies a journal segment's lines to state in order; returns how many were applied."""
+    if not os.path.exists(path):
+        return 0
+    applied = 0
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Journal {path} ends in a partial line after {applied} ticks; ignoring it")
+                break
+            apply_entry(state, entry)
+            applied += 1
+    return applied
+
+
+def apply_entry(state: dict, entry: dict):
+    fauna = state["fauna"]
+    for record in fauna.values():
+        if not record["is_dead"]:
+            record["age_seconds"] += entry["dt"]
+    fauna.update(entry.get("fauna", {}))
+    for fauna_id, (x, y) in entry.get("moved", {}).items():
+        if fauna_id in fauna:
+            fauna[fauna_id].update(x=x, y=y)
+    for fauna_id in entry.get("removed", []):
+        fauna.pop(fauna_id, None)
+    state["food"].update(entry.get("food", {}))
+    for food_id in entry.get("food_removed", []):
+        state["food"].pop(food_id, None)
+    for x, y, w, h, tiles in entry.get("tiles", []):
+        tiles = base64.b64decode(tiles)
+        for row in range(h):
+            offset = (y + row) * state["map"].width + x
+            state["map"].tiles[offset:offset + w] = tiles[row * w:(row + 1) * w]
+
+
+def load_world(directory: str):
+    """The world as of the last journaled tick, or None if there is no snapshot yet."""
+    seqs = snapshot_seqs(directory)
+    if not seqs:
+        return None
+    state = read_snapshot(directory, seqs[-1])
+    ticks = replay_segment(state, segment_path(directory, seqs[-1]))
+    print(f"Loaded snapshot {seqs[-1]} from {directory} and replayed {ticks} journaled ticks")
+    return state
+
+
+# --- Writing ---
+class WorldJournal:
+    """Appends one line per tick and takes snapshots. Everything touching files runs on one background thread, in order."""
+
+    def __init__(self, directory: str, snapshot_interval: float = SNAPSHOT_INTERVAL, keep: int = JOURNAL_KEEP_SNAPSHOTS):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.snapshot_interval = snapshot_interval
+        self.keep = keep
+        seqs = snapshot_seqs(directory)
+        self.seq = seqs[-1] if seqs else 0
+        self.last_snapshot = time.monotonic()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="journal-io")
+        self._segment = None # Open file for journal-<seq>.jsonl; journal thread only
+        self._segment_seq = self.seq # Snapshot the segment being appended to belongs to; journal thread only
+        self._last_fsync = 0.0
+        self._pending = {} # Changes made between ticks (dropped food, tiles), written with the next tick's line
+        # --- Metrics ---
+        self.lines = 0
+        self.bytes = 0
+        self.snapshots = 0
+        self.last_snapshot_bytes = 0
+        self.last_snapshot_seconds = 0.0
+
+    # --- Recording ---
+    def food_spawned(self, food_id: str, food: dict):
+        self._pending.setdefault("food", {})[food_id] = food
+
+    def tiles_changed(self, x: int, y: int, w: int, h: int, tiles):
+        self._pending.setdefault("tiles", []).append([x, y, w, h, base64.b64encode(tiles).decode()])
+
+    def record_tick(self, delta, dt: float):
+        """Queues the journal line for one tick: its delta plus whatever changed since the last line."""
+        entry, self._pending = self._pending, {}
+        entry["tick"], entry["dt"] = delta.tick, dt
+        removed = set(delta.fauna_removed)
+        records = {fid: dict(delta.fauna[fid]) for fid in delta.fauna_spawned | delta.fauna_updated if fid not in removed}
+        # Moves are just positions: goals change far less often than fauna move, and are re-chosen anyway
+        moved = {fid: [delta.fauna[fid]["x"], delta.fauna[fid]["y"]] for fid in delta.fauna_moved if fid not in removed and fid not in records}
+        if records:
+            entry["fauna"] = records
+        if moved:
+            entry["moved"] = moved
+        if delta.fauna_removed:
+            entry["removed"] = list(delta.fauna_removed)
+        if delta.food_spawned:
+            entry.setdefault("food", {}).update(delta.food_spawned)
+        if delta.food_removed:
+            entry["food_removed"] = list(delta.food_removed)
+        self._executor.submit(self._append, entry)
+
+    def snapshot_due(self) -> bool:
+        return time.monotonic() - self.last_snapshot >= self.snapshot_interval
+
+    def snapshot(self, world_state: dict, tick: int = 0):
+        """
+        Starts a new snapshot of world_state (call the fauna engine's sync_world_state first). The
+        world is copied here; encoding and writing happen in the background, and lines recorded
+        from now on go to the new snapshot's segment.
+        """
+        tile_map = world_state["map"]
+        snapshot = {
+            "tick": tick,
+            "time": time.time(),
+            "fauna": {fauna_id: dict(fauna) for fauna_id, fauna in world_state["fauna"].items()},
+            "food": {food_id: dict(food) for food_id, food in world_state["food"].items()},
+            "map": {"width": tile_map.width, "height": tile_map.height, "tiles": bytes(tile_map.view())},
+        }
+        # Changes since the last line are part of the snapshot; they only go to the journal if it fails
+        pending, self._pending = self._pending, {}
+        self.seq += 1
+        self.last_snapshot = time.monotonic()
+        self._executor.submit(self._write_snapshot, self.seq, snapshot, pending)
+
+    async def close(self):
+        """Writes out everything queued so far and closes the segment."""
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close_segment)
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        return {
+            "seq": self.seq,
+            "lines": self.lines,
+            "bytes": self.bytes,
+            "snapshots": self.snapshots,
+            "last_snapshot_bytes": self.last_snapshot_bytes,
+            "last_snapshot_seconds": round(self.last_snapshot_seconds, 4),
+        }
+
+    # --- Journal thread ---
+    def _append(self, entry: dict):
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        try:
+            if self._segment is None:
+                self._segment = open(segment_path(self.directory, self._segment_seq), "a")
+            self._segment.write(line)
+            self._segment.flush()
+            if time.monotonic() - self._last_fsync >= JOURNAL_FSYNC_INTERVAL:
+                os.fsync(self._segment.fileno())
+                self._last_fsync = time.monotonic()
+        except OSError as e:
+            print(f"Dropping journal line: {e}")
+            return
+        self.lines += 1
+        self.bytes += len(line)
+
+    def _write_snapshot(self, seq: int, snapshot: dict, pending: dict):
+        started = time.perf_counter()
+        snapshot["map"]["tiles"] = base64.b64encode(snapshot["map"]["tiles"]).decode()
+        path = snapshot_path(self.directory, seq)
+        try:
+            # Written under a temporary name so a snapshot file that exists is always complete
+            with gzip.open(path + ".tmp", "wt", compresslevel=1) as f:
+                json.dump(snapshot, f, separators=(",", ":"))
+            with open(path + ".tmp", "rb") as f:
+                os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            # The previous snapshot's segment stays current, so what was journaled stays replayable;
+            # the changes the snapshot would have carried are appended to it as a line of their own
+            print(f"Snapshot {seq} failed: {e}")
+            if pending:
+                self._append({**pending, "tick": snapshot["tick"], "dt": 0.0})
+            return
+        self._close_segment()
+        self._segment_seq = seq
+        self.snapshots += 1
+        self.last_snapshot_bytes = os.path.getsize(path)
+        self.last_snapshot_seconds = time.perf_counter() - started
+        self._compact(seq)
+
+    def _close_segment(self):
+        if self._segment is not None:
+            self._segment.flush()
+            os.fsync(self._segment.fileno())
+            self._segment.close()
+            self._segment = None
+
+    def _compact(self, seq: int):
+        """Deletes the snapshots and segments that the newest JOURNAL_KEEP_SNAPSHOTS snapshots supersede."""
+        for old in snapshot_seqs(self.directory):
+            if old <= seq - self.keep:
+                for path in (snapshot_path(self.directory, old), segment_path(self.directory, old)):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+
+class DiscardingStore:
+    """
+    Stands in for AsyncStore where journal mode replaces row writes (the fauna engines, and main's
+    fauna/food/map writes): the same changes are journaled from the tick instead.
+    """
+
+    async def write(self, query: str, params: tuple = ()):
+        pass
+
+    async def write_many(self, query: str, params_seq):
+        pass
+
+    async def write_region(self, x: int, y: int, w: int, h: int, tiles):
+        pass
+
+    async def batch(self, statements):
+        pass
@@ -1,15 +1,27 @@
+import os
 import json
 import uuid
 import random
 import asyncio
 import time
 import math
-from typing import List
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
-from db import init_db, load_state_from_db, initialize_default_world, db_write, db_read
-from fauna import FaunaManager, TICK_RATE, FAUNA_AGE_STAGES # Import the new manager, TICK_RATE, and FAUNA_AGE_STAGES
+from db import init_db, load_state_from_db, initialize_default_world, AsyncStore, db_flush_stats, journal_dir, PERSISTENCE_MODE
+from journal import WorldJournal, DiscardingStore
+from fauna import create_fauna_manager, TICK_RATE, FAUNA_AGE_STAGES # Import the manager factory, TICK_RATE, and FAUNA_AGE_STAGES
+from protocol import TickDelta, negotiate_protocol, negotiate_encoding, world_fits_binary, PROTOCOL_LEGACY
+from connections import ConnectionManager
+from world_sync import MapChunkCache, negotiate_sync, SYNC_CHUNKED
+from ticks import TickScheduler, TickMetrics
+from tilemap import encode_world, TILE_SIZE
+from ratelimit import MOVE_BROADCAST_RATE, RATE_LIMITS
+from instrumentation import metrics, encode_message, SamplingProfiler, PROFILE_DIR, DEFAULT_PROFILE_TICKS, MAX_PROFILE_TICKS, DEBUG_CLIENTS
+
+# --- Zone Sharding ---
+ZONE_ID = None # Set by zones.py when this module runs as one zone worker behind gateway.py
 
 # --- FastAPI App and Game State Initialization ---
 app = FastAPI()
@@ -19,67 +31,180 @@ if world_state is None:
     initialize_default_world()
     world_state = load_state_from_db()
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-        self.player_data = {}
-    async def connect(self, websocket: WebSocket) -> str:
-        await websocket.accept()
-        player_id = str(uuid.uuid4().hex[:6])
-        self.active_connections.append(websocket)
-        self.player_data[websocket] = player_id
-        return player_id
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.player_data:
-            player_id = self.player_data[websocket]
-            self.active_connections.remove(websocket)
-            del self.player_data[websocket]
-            return player_id
-        return None
-    async def broadcast(self, message: str):
-        disconnected_connections = []
-        for connection in self.active_connections[:]:  # Use slice to avoid modification during iteration
-            try:
-                await connection.send_text(message)
-            except Exception as e:
-                print(f"Error sending message to connection: {e}")
-                disconnected_connections.append(connection)
-        
-        # Clean up disconnected connections
-        for connection in disconnected_connections:
-            self.disconnect(connection)
+manager = ConnectionManager(world_state)
+world_map = world_state["map"]
+# Binary tick frames carry int16 positions; a world too big for them is served JSON frames only
+binary_fits = world_fits_binary(world_map.width * TILE_SIZE, world_map.height * TILE_SIZE)
+if not binary_fits:
+    print(f"The {world_map.width}x{world_map.height} tile map is too big for binary frames; clients get JSON frames")
+# Tile changes reach the database as the dirty regions of the map, once per tick
+world_map.track("persistence")
+# Encoded map chunks for chunked joins, kept until a tile in them changes
+map_chunks = MapChunkCache(world_map)
+# All persistence from async code goes through the store so SQLite never blocks the event loop
+store = AsyncStore()
+# In journal mode fauna, food and map changes are journaled once per tick instead of written as rows;
+# players stay in the users table either way
+journal = WorldJournal(journal_dir()) if PERSISTENCE_MODE == "journal" else None
+world_store = store if journal is None else DiscardingStore()
+if journal is not None:
+    journal.snapshot(world_state) # Starts a fresh segment, and moves a world loaded from the tables into the journal
+# Create the fauna engine selected by FAUNA_ENGINE (dict or vectorized)
+fauna_manager = create_fauna_manager(world_state, world_store)
 
-manager = ConnectionManager()
-# Create an instance of the FaunaManager
-fauna_manager = FaunaManager(world_state, manager.broadcast)
+# Ticks fire on fixed deadlines rather than TICK_RATE after the previous one finished
+scheduler = TickScheduler(TICK_RATE)
+tick_metrics = TickMetrics(TICK_RATE)
+# Players who moved since the last player_moved broadcast -> their websocket
+pending_moves = {}
+# Held while a profile is being captured; only one runs at a time
+profile_lock = asyncio.Lock()
 
 async def game_loop():
     """The main server-side game loop."""
     while True:
-        await asyncio.sleep(TICK_RATE)
+        dt = await scheduler.wait()
+        tick_metrics.start_tick(dt)
+        delta = TickDelta(scheduler.tick, legacy=manager.has_legacy_clients())
         
         # The complex fauna logic is now handled by the manager
-        fauna_to_add, fauna_to_remove, food_to_remove = await fauna_manager.update_fauna()
+        with tick_metrics.phase("ai"):
+            fauna_to_add, fauna_to_remove, food_to_remove = await fauna_manager.update_fauna(delta, dt)
 
         # Update the world state based on the results from the manager
-        for new_id, new_data in fauna_to_add:
-            world_state["fauna"][new_id] = new_data
-            await manager.broadcast(json.dumps({"type": "fauna_spawned", "fauna_id": new_id, "data": new_data}))
-        for fauna_id in fauna_to_remove:
-            if fauna_id in world_state["fauna"]:
-                del world_state["fauna"][fauna_id]
-                db_write("DELETE FROM fauna WHERE id = ?", (fauna_id,))
-                await manager.broadcast(json.dumps({"type": "fauna_removed", "fauna_id": fauna_id}))
-        for food_id in food_to_remove:
-            if food_id in world_state["food"]:
-                del world_state["food"][food_id]
-                db_write("DELETE FROM food WHERE id = ?", (food_id,))
-                await manager.broadcast(json.dumps({"type": "food_removed", "food_id": food_id}))
+        with tick_metrics.phase("persistence"):
+            for new_id, new_data in fauna_to_add:
+                world_state["fauna"][new_id] = new_data
+                delta.fauna_spawn(new_id, new_data)
+            for fauna_id in fauna_to_remove:
+                if fauna_id in world_state["fauna"]:
+                    del world_state["fauna"][fauna_id]
+                    await world_store.write("DELETE FROM fauna WHERE id = ?", (fauna_id,))
+                    delta.fauna_remove(fauna_id)
+            for food_id in food_to_remove:
+                if fauna_manager.remove_food(food_id):
+                    await world_store.write("DELETE FROM food WHERE id = ?", (food_id,))
+                    delta.food_remove(food_id)
+            await persist_map_changes()
+            if journal is not None:
+                journal.record_tick(delta, dt)
+                if journal.snapshot_due():
+                    fauna_manager.sync_world_state()
+                    journal.snapshot(world_state, scheduler.tick)
+            # Everything this tick wrote goes to disk as one transaction on the writer thread
+            store.request_flush()
+
+        # One frame per tick, serialized once, instead of a message per event
+        with tick_metrics.phase("broadcast"):
+            await manager.broadcast_delta(delta)
+        tick_metrics.end_tick()
+
+async def persist_map_changes():
+    """Queues the regions of the map that changed since the last call."""
+    for x, y, w, h in world_map.take_dirty("persistence"):
+        tiles = world_map.region(x, y, w, h)
+        await world_store.write_region(x, y, w, h, tiles)
+        if journal is not None:
+            journal.tiles_changed(x, y, w, h, tiles)
+
+async def move_loop():
+    """Broadcasts each moving player's latest position MOVE_BROADCAST_RATE times a second, however often they send moves."""
+    while True:
+        await asyncio.sleep(1 / MOVE_BROADCAST_RATE)
+        moves = list(pending_moves.items())
+        pending_moves.clear()
+        for player_id, websocket in moves:
+            player = world_state["players"].get(player_id)
+            if player is None:
+                continue # Left since moving
+            # One task serves every player, so a failure only skips this move
+            try:
+                await manager.broadcast_entity("players", player_id, encode_message({"type": "player_moved", "player_id": player_id, "data": player}), key=f"player_moved:{player_id}")
+                await manager.move_viewer(websocket, player["x"], player["y"])
+            except Exception as e:
+                print(f"Skipping the move of player {player_id}: {e}")
 
 @app.on_event("startup")
 async def startup_event_full():
-    """On server startup, create the main game loop task."""
+    """On server startup, create the main game loop and move broadcast tasks."""
     asyncio.create_task(game_loop())
+    asyncio.create_task(move_loop())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush any queued writes before the process exits."""
+    if journal is not None:
+        fauna_manager.sync_world_state()
+        journal.snapshot(world_state, scheduler.tick)
+        await journal.close()
+    await store.close()
+
+@app.get("/metrics/ticks")
+async def tick_metrics_endpoint():
+    """Scheduler state, per-phase game loop timings and overruns, and how the database writer is keeping up."""
+    return {"scheduler": scheduler.stats(), "timings": tick_metrics.stats(), "db_writer": db_flush_stats(), "journal": journal.stats() if journal else None}
+
+@app.get("/metrics/connections")
+async def connection_metrics():
+    """Outbound queue depth and drop counts for every connected client."""
+    return {"policy": manager.policy, "clients": manager.queue_stats(), "map_chunks": map_chunks.stats()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Everything above plus the instrumentation's hot-path timings, as Prometheus text."""
+    gauges = [("tick_overruns", {}, tick_metrics.overruns), ("clients", {}, len(manager.clients)), ("db_pending_writes", {}, db_flush_stats()["pending_writes"])]
+    gauges += [(kind, {}, len(world_state[kind])) for kind in ("players", "fauna", "food")]
+    for phase, timings in tick_metrics.stats()["phases"].items():
+        gauges.append(("tick_phase_last_seconds", {"phase": phase}, timings["last_ms"] / 1000))
+        gauges.append(("tick_phase_avg_seconds", {"phase": phase}, timings["avg_ms"] / 1000))
+    for player_id, stats in manager.queue_stats().items():
+        gauges.append(("client_queue_depth", {"player_id": player_id}, stats["queue_depth"]))
+    return metrics.render(gauges)
+
+def local_only(request: Request):
+    """Rejects /debug calls from anywhere but DEBUG_CLIENTS; there are no admin accounts to check instead."""
+    if request.client is None or request.client.host not in DEBUG_CLIENTS:
+        raise HTTPException(status_code=403, detail="Debug routes are only served to local clients")
+
+@app.post("/debug/instrumentation", dependencies=[Depends(local_only)])
+async def set_instrumentation(enabled: bool, reset: bool = False):
+    """Switches hot-path instrumentation on or off at runtime; reset clears what has been recorded."""
+    metrics.enabled = enabled
+    if reset:
+        metrics.reset()
+    return {"enabled": metrics.enabled}
+
+@app.post("/debug/profile", dependencies=[Depends(local_only)])
+async def profile_endpoint(ticks: int = DEFAULT_PROFILE_TICKS):
+    """Captures a sampling profile of the next N ticks (at most MAX_PROFILE_TICKS) and returns where it was written."""
+    result = await capture_profile(ticks)
+    if result is None:
+        raise HTTPException(status_code=409, detail="A profile is already being captured")
+    return result
+
+async def capture_profile(ticks: int = DEFAULT_PROFILE_TICKS):
+    """
+    Samples the event loop thread (this coroutine's own) for the next `ticks` game loop ticks into PROFILE_DIR,
+    clamped to 1..MAX_PROFILE_TICKS. Returns None without sampling if another profile is still running.
+    """
+    if profile_lock.locked():
+        print("A profile is already being captured; ignoring this one")
+        return None
+    ticks = max(1, min(ticks, MAX_PROFILE_TICKS))
+    async with profile_lock:
+        profiler = SamplingProfiler()
+        until = scheduler.tick + ticks
+        profiler.start()
+        try:
+            while scheduler.tick < until:
+                await asyncio.sleep(scheduler.period / 4)
+        finally:
+            profiler.stop()
+    zone = f"zone-{ZONE_ID}-" if ZONE_ID else ""
+    path = os.path.join(PROFILE_DIR, f"profile-{zone}{time.strftime('%Y%m%d-%H%M%S')}-{ticks}ticks.folded")
+    profiler.write(path)
+    print(f"Wrote a {ticks} tick profile ({profiler.samples} samples) to {path}")
+    return {"path": path, "ticks": ticks, "samples": profiler.samples}
 
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
 
@@ -101,72 +226,105 @@ async def websocket_endpoint(websocket: WebSocket):
         if message.get("type") == "player_join_request":
             player_name = message.get("name", "Anon")
             if any(p.get("name") == player_name for p in world_state["players"].values()):
-                await websocket.send_text(json.dumps({"type": "error", "reason": "name_taken"}))
-                await websocket.close()
-                manager.disconnect(websocket)
+                await manager.send(websocket, encode_message({"type": "error", "reason": "name_taken"}))
+                await manager.close(websocket)
                 return
 
-            player_row = db_read("SELECT x, y FROM users WHERE name = ?", (player_name,))
-            if player_row:
+            player_row = await store.read("SELECT x, y FROM users WHERE name = ?", (player_name,))
+            # Only the gateway can add a handoff, when a player walks over from a neighbouring zone
+            handoff = message.get("handoff") if ZONE_ID is not None else None
+            if handoff:
+                start_x, start_y = handoff["x"], handoff["y"]
+                await store.write("INSERT OR REPLACE INTO users (name, x, y) VALUES (?, ?, ?)", (player_name, start_x, start_y))
+            elif player_row:
                 start_x, start_y = player_row[0]
             else:
                 start_x, start_y = random.randint(50, 750), random.randint(50, 550)
-                db_write("INSERT INTO users (name, x, y) VALUES (?, ?, ?)", (player_name, start_x, start_y))
+                await store.write("INSERT INTO users (name, x, y) VALUES (?, ?, ?)", (player_name, start_x, start_y))
             
             world_state["players"][player_id] = {"x": start_x, "y": start_y, "name": player_name}
+            protocol = negotiate_protocol(message.get("protocol", PROTOCOL_LEGACY))
+            manager.set_protocol(websocket, protocol)
+            encoding = negotiate_encoding(message.get("encoding"), protocol, binary_fits)
+            manager.set_encoding(websocket, encoding)
+            sync = negotiate_sync(message.get("sync"))
+            manager.set_sync(websocket, sync)
             is_joined = True
             print(f"Player {player_name} ({player_id}) successfully joined.")
 
-            await websocket.send_text(json.dumps({"type": "join_success"}))
-            await websocket.send_text(json.dumps({"type": "world_state", "player_id": player_id, "world": world_state}))
-            await manager.broadcast(json.dumps({"type": "player_joined", "player_id": player_id, "data": world_state["players"][player_id]}))
+            await manager.send(websocket, encode_message({"type": "join_success", "protocol": protocol, "encoding": encoding, "sync": sync}))
+            fauna_manager.sync_world_state()
+            if sync == SYNC_CHUNKED:
+                await manager.track_viewer(websocket, start_x, start_y, sent_world=False)
+                await manager.sync_world(websocket, map_chunks, player_id)
+            else:
+                await manager.send(websocket, encode_message({"type": "world_state", "player_id": player_id, "world": world_state}, default=encode_world))
+                await manager.track_viewer(websocket, start_x, start_y)
+            await manager.broadcast_entity("players", player_id, encode_message({"type": "player_joined", "player_id": player_id, "data": world_state["players"][player_id]}), spawned=True)
         else:
             print(f"Invalid first message from {player_id}. Closing.")
-            await websocket.close()
-            manager.disconnect(websocket)
+            await manager.close(websocket)
             return
 
         while True:
             data = await websocket.receive_text()
             message = json.loads(data)
+            # Unknown types still spend from the shared "other" bucket, so a flood of them shows up as rejected
+            if not manager.allow(websocket, message.get("type")):
+                if message.get("type") in RATE_LIMITS and message["type"] != "player_move":
+                    await manager.send(websocket, encode_message({"type": "error", "reason": "rate_limited", "message_type": message["type"]}), key=f"rate_limited:{message['type']}")
+                continue
+            if message["type"] not in RATE_LIMITS:
+                continue # Not something a joined client sends; never echoed back
             
             if message["type"] == "player_chat":
                 text = message.get("text", "")
                 if text.startswith("/"):
                     if text == "/reset_zone":
                         print(f"Admin command '/reset_zone' issued by {player_name}")
-                        world_state["food"].clear()
-                        db_write("DELETE FROM food")
-                        world_state["fauna"].clear()
-                        db_write("DELETE FROM fauna")
-                        for y in range(len(world_state["map"])):
-                            for x in range(len(world_state["map"][y])):
-                                world_state["map"][y][x] = 0
-                        db_write("UPDATE zone_tiles SET tile_type = 0")
+                        fauna_manager.clear_food()
+                        new_fauna = {}
+                        world_map.fill(0)
+                        await persist_map_changes()
+                        reset_writes = [("DELETE FROM food", ()), ("DELETE FROM fauna", ())]
+                        new_fauna_rows = []
                         for i in range(3):
                             fauna_id = f"dragon_adult_{i}"
                             fauna_data = {"x": random.randint(50, 750), "y": random.randint(50, 550), "kind": "dragon", "age_seconds": FAUNA_AGE_STAGES["Young"] + 1, "stage": "Adult", "is_dead": False, "time_of_death": None, "offspring_count": 0, "death_timer": None, "goal": None}
-                            world_state["fauna"][fauna_id] = fauna_data
-                            db_write("INSERT INTO fauna (id, kind, x, y, age_seconds, stage, is_dead, offspring_count, goal) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (fauna_id, fauna_data["kind"], fauna_data["x"], fauna_data["y"], fauna_data["age_seconds"], "Adult", False, 0, None))
-                        await manager.broadcast(json.dumps({"type": "world_reset", "world": world_state}))
+                            new_fauna[fauna_id] = fauna_data
+                            new_fauna_rows.append((fauna_id, fauna_data["kind"], fauna_data["x"], fauna_data["y"], fauna_data["age_seconds"], "Adult", False, 0, None))
+                        reset_writes.append(("INSERT INTO fauna (id, kind, x, y, age_seconds, stage, is_dead, offspring_count, goal) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", new_fauna_rows, True))
+                        fauna_manager.reset_fauna(new_fauna)
+                        await world_store.batch(reset_writes)
+                        if journal is not None:
+                            journal.snapshot(world_state, scheduler.tick)
+                        await manager.reset_world(map_chunks)
                 else:
-                    await manager.broadcast(json.dumps({"type": "player_chatted", "player_id": player_id, "text": text}))
+                    await manager.broadcast(encode_message({"type": "player_chatted", "player_id": player_id, "text": text}))
             elif message["type"] == "player_move":
-                px, py = message["x"], message["y"]
+                position = manager.clamp_position(message.get("x"), message.get("y"))
+                if position is None:
+                    continue # Not a finite position; the next move carries the real one
+                px, py = position
                 world_state["players"][player_id].update({"x": px, "y": py})
-                await manager.broadcast(json.dumps({"type": "player_moved", "player_id": player_id, "data": world_state["players"][player_id]}))
+                pending_moves[player_id] = websocket # Broadcast by move_loop
             elif message["type"] == "action_till":
                 tx, ty = message["tile"]["x"], message["tile"]["y"]
-                if 0 <= ty < len(world_state["map"]) and 0 <= tx < len(world_state["map"][0]) and world_state["map"][ty][tx] == 0:
-                    world_state["map"][ty][tx] = 1
-                    db_write("UPDATE zone_tiles SET tile_type = 1 WHERE x = ? AND y = ?", (tx, ty))
-                    await manager.broadcast(json.dumps({"type": "tile_updated", "tile": {"x": tx, "y": ty, "type": 1}}))
+                if world_map.in_bounds(tx, ty) and world_map.get(tx, ty) == 0:
+                    world_map.set(tx, ty, 1)
+                    await manager.broadcast(encode_message({"type": "tile_updated", "tile": {"x": tx, "y": ty, "type": 1}}))
             elif message["type"] == "action_drop_food":
                 food_id = f"food_{uuid.uuid4().hex[:6]}"
-                pos = message["pos"]
-                world_state["food"][food_id] = {"x": pos["x"], "y": pos["y"]}
-                db_write("INSERT INTO food (id, x, y) VALUES (?, ?, ?)", (food_id, pos["x"], pos["y"]))
-                await manager.broadcast(json.dumps({"type": "food_spawned", "food_id": food_id, "data": world_state["food"][food_id]}))
+                pos = message.get("pos")
+                position = manager.clamp_position(pos.get("x"), pos.get("y")) if isinstance(pos, dict) else None
+                if position is None:
+                    continue
+                fx, fy = position
+                fauna_manager.add_food(food_id, {"x": fx, "y": fy})
+                await world_store.write("INSERT INTO food (id, x, y) VALUES (?, ?, ?)", (food_id, fx, fy))
+                if journal is not None:
+                    journal.food_spawned(food_id, world_state["food"][food_id])
+                await manager.broadcast_entity("food", food_id, encode_message({"type": "food_spawned", "food_id": food_id, "data": world_state["food"][food_id]}), spawned=True)
 
     except WebSocketDisconnect:
         print(f"Player {player_name} ({player_id}) disconnected.")
@@ -175,8 +333,9 @@ async def websocket_endpoint(websocket: WebSocket):
     finally:
         if is_joined and player_id in world_state["players"]:
             final_pos = world_state["players"][player_id]
-            db_write("UPDATE users SET x = ?, y = ? WHERE name = ?", (final_pos["x"], final_pos["y"], player_name))
+            await store.write("UPDATE users SET x = ?, y = ? WHERE name = ?", (final_pos["x"], final_pos["y"], player_name))
             del world_state["players"][player_id]
-            await manager.broadcast(json.dumps({"type": "player_left", "player_id": player_id}))
-        if websocket in manager.player_data:
+            manager.untrack_entity("players", player_id)
+            await manager.broadcast(encode_message({"type": "player_left", "player_id": player_id}))
+        if websocket in manager.clients:
             manager.disconnect(websocket)
@@ -0,0 +1,296 @@
+"""
+Wire protocol versions and the per-tick delta frame.
+
+Protocol 1 (legacy) clients get one JSON message per fauna/food event, exactly as before: each
+fauna message carries the record as it was when that event happened, not as it ended the tick.
+Protocol 2 clients get a single "tick_delta" frame per tick carrying everything that changed,
+as JSON text or, if they asked for encoding "binary", as a compact binary websocket frame.
+"""
+
+import json
+import struct
+
+from instrumentation import metrics
+
+# --- Protocol Versions ---
+PROTOCOL_LEGACY = 1 # One message per event
+PROTOCOL_DELTA = 2 # One tick_delta frame per tick
+LATEST_PROTOCOL = PROTOCOL_DELTA
+
+
+def negotiate_protocol(requested) -> int:
+    """Picks the protocol for a client from the version it asked for in its join request."""
+    try:
+        requested = int(requested)
+    except (TypeError, ValueError):
+        return PROTOCOL_LEGACY
+    return max(PROTOCOL_LEGACY, min(requested, LATEST_PROTOCOL))
+
+
+# --- Encodings ---
+ENCODING_JSON = "json"
+ENCODING_BINARY = "binary" # tick_delta frames only; every other message stays JSON text
+
+
+def negotiate_encoding(requested, protocol: int, binary_fits: bool = True) -> str:
+    """
+    Binary frames only exist for tick_delta, so they need protocol 2, and only carry positions of a
+    world that fits them (binary_fits, see world_fits_binary); anything else falls back to JSON.
+    """
+    if requested == ENCODING_BINARY and protocol >= PROTOCOL_DELTA and binary_fits:
+        return ENCODING_BINARY
+    return ENCODING_JSON
+
+
+class TickDelta:
+    """Collects everything that changed during one tick so it can be sent as a single frame."""
+
+    def __init__(self, tick: int, legacy: bool = False):
+        self.tick = tick
+        # Ordered (event_type, id, record) triples, used to replay the tick as legacy per-event messages.
+        # With legacy set, fauna events keep a copy of the record as it was at that point in the tick;
+        # without it (no protocol 1 clients to replay to) record is None and nothing is copied.
+        self.legacy = legacy
+        self.events = []
+        self.fauna = {} # id -> fauna dict for every fauna touched this tick
+        self.fauna_moved = set()
+        self.fauna_updated = set()
+        self.fauna_spawned = set()
+        self.fauna_removed = []
+        self.food_spawned = {}
+        self.food_removed = []
+
+    def is_empty(self) -> bool:
+        return not self.events
+
+    # --- Recording ---
+    def fauna_moved_to(self, fauna_id: str, fauna: dict):
+        self.fauna[fauna_id] = fauna
+        self.fauna_moved.add(fauna_id)
+        self._event("fauna_moved", fauna_id, fauna)
+
+    def fauna_stage_changed(self, fauna_id: str, fauna: dict):
+        self.fauna[fauna_id] = fauna
+        self.fauna_updated.add(fauna_id)
+        self._event("fauna_stage_changed", fauna_id, fauna)
+
+    def fauna_died(self, fauna_id: str, fauna: dict):
+        self.fauna[fauna_id] = fauna
+        self.fauna_updated.add(fauna_id)
+        self._event("fauna_died", fauna_id, fauna)
+
+    def fauna_spawn(self, fauna_id: str, fauna: dict):
+        self.fauna[fauna_id] = fauna
+        self.fauna_spawned.add(fauna_id)
+        self._event("fauna_spawned", fauna_id, fauna)
+
+    def fauna_remove(self, fauna_id: str):
+        self.fauna_removed.append(fauna_id)
+        self._event("fauna_removed", fauna_id)
+
+    def food_spawn(self, food_id: str, food: dict):
+        self.food_spawned[food_id] = food
+        self._event("food_spawned", food_id)
+
+    def food_remove(self, food_id: str):
+        self.food_removed.append(food_id)
+        self._event("food_removed", food_id)
+
+    def _event(self, event_type: str, entity_id: str, fauna: dict = None):
+        record = dict(fauna) if self.legacy and fauna is not None else None
+        self.events.append((event_type, entity_id, record))
+
+    # --- Encoding ---
+    def to_frame(self) -> dict:
+        """Builds the protocol 2 frame. Empty sections are left out to keep it small."""
+        removed = set(self.fauna_removed)
+        frame = {"type": "tick_delta", "tick": self.tick}
+        spawned = {fid: self.fauna[fid] for fid in self.fauna_spawned if fid not in removed}
+        # Spawned and updated entries already carry the full record, so they don't need a move entry
+        updated = {fid: self.fauna[fid] for fid in self.fauna_updated if fid not in removed and fid not in spawned}
+        moved = {
+            fid: {"x": self.fauna[fid]["x"], "y": self.fauna[fid]["y"]}
+            for fid in self.fauna_moved
+            if fid not in removed and fid not in spawned and fid not in updated
+        }
+        if moved: frame["fauna_moved"] = moved
+        if updated: frame["fauna_updated"] = updated
+        if spawned: frame["fauna_spawned"] = spawned
+        if self.fauna_removed: frame["fauna_removed"] = self.fauna_removed
+        if self.food_spawned: frame["food_spawned"] = self.food_spawned
+        if self.food_removed: frame["food_removed"] = self.food_removed
+        return frame
+
+    def to_legacy_messages(self) -> list:
+        """Replays the tick as the protocol 1 per-event messages, in the order they happened."""
+        messages = []
+        for event_type, entity_id, record in self.events:
+            if event_type in ("fauna_moved", "fauna_stage_changed", "fauna_died", "fauna_spawned"):
+                messages.append({"type": event_type, "fauna_id": entity_id, "data": record if record is not None else self.fauna[entity_id]})
+            elif event_type == "fauna_removed":
+                messages.append({"type": event_type, "fauna_id": entity_id})
+            elif event_type == "food_spawned":
+                messages.append({"type": event_type, "food_id": entity_id, "data": self.food_spawned[entity_id]})
+            elif event_type == "food_removed":
+                messages.append({"type": event_type, "food_id": entity_id})
+        return messages
+
+
+# Sections of a tick_delta frame that map entity ids to data; the rest are lists of ids
+FRAME_DATA_SECTIONS = ("fauna_moved", "fauna_updated", "fauna_spawned", "food_spawned", "fauna_entered", "food_entered", "players_entered")
+
+
+class FrameEncoder:
+    """
+    Encodes tick_delta frames for many clients that each see a different subset of the tick.
+
+    Every "id": {...} entry is serialized once and cached, so building a per-client frame is
+    a string join rather than another json.dumps over the same entities.
+    """
+
+    def __init__(self, tick: int):
+        self.tick = tick
+        self._entries = {}
+
+    def _entry(self, entity_id, value):
+        key = (entity_id, id(value))
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = f"{json.dumps(entity_id)}: {json.dumps(value)}"
+        return entry
+
+    def encode(self, sections: dict) -> str:
+        """sections maps a section name to {id: data} or [ids]; empty sections are skipped."""
+        parts = [f'"type": "tick_delta", "tick": {self.tick}']
+        for name, content in sections.items():
+            if not content:
+                continue
+            if name in FRAME_DATA_SECTIONS:
+                inner = ", ".join(self._entry(entity_id, value) for entity_id, value in content.items())
+                parts.append(f'"{name}": {{{inner}}}')
+            else:
+                parts.append(f'"{name}": {json.dumps(list(content))}')
+        return "{" + ", ".join(parts) + "}"
+
+
+# --- Binary tick_delta Layout ---
+# Little-endian. A frame is a header followed by sections; a section is its code, an entry count and
+# the entries. Big sections are split into several runs of the same code. Strings (ids, names) are a
+# u8 byte length plus UTF-8. Positions are int16 in quarter pixels, so they only reach +/-MAX_BINARY_POSITION
+# px: main.py only offers the binary encoding when the map fits, and bigger worlds run on JSON frames.
+# Serving them binary too means widening _POSITION/_FAUNA to int32 ("<ii", "<BiiBBfH") and bumping
+# BINARY_VERSION, in step with client/src/binaryProtocol.js, which decodes it.
+BINARY_FRAME_TICK_DELTA = 1
+BINARY_VERSION = 1
+POSITION_SCALE = 4 # Quarter-pixel positions
+MAX_BINARY_POSITION = 0x7FFF // POSITION_SCALE # 8191 px, a map of 511 16-pixel tiles a side
+FAUNA_KIND_CODES = {"dragon": 0}
+FAUNA_STAGE_CODES = {"Infant": 0, "Young": 1, "Adult": 2, "Elderly": 3}
+UNKNOWN_CODE = 255
+FLAG_DEAD = 1
+
+_HEADER = struct.Struct("<BBI") # frame type, version, tick
+_SECTION = struct.Struct("<BH") # section code, entry count
+_POSITION = struct.Struct("<hh")
+_FAUNA = struct.Struct("<BhhBBfH") # kind, x, y, stage, flags, age_seconds, offspring_count
+_MAX_SECTION_ENTRIES = 0xFFFF
+
+# section name -> (code, entry layout)
+BINARY_SECTIONS = {
+    "fauna_moved": (1, "position"),
+    "fauna_updated": (2, "fauna"),
+    "fauna_spawned": (3, "fauna"),
+    "fauna_removed": (4, "id"),
+    "food_spawned": (5, "position"),
+    "food_removed": (6, "id"),
+    "fauna_entered": (7, "fauna"),
+    "fauna_left": (8, "id"),
+    "food_entered": (9, "position"),
+    "food_left": (10, "id"),
+    "players_entered": (11, "player"),
+    "players_left": (12, "id"),
+}
+
+
+def _pack_str(value) -> bytes:
+    data = str(value).encode("utf-8")[:255]
+    return bytes((len(data),)) + data
+
+
+def world_fits_binary(width: float, height: float) -> bool:
+    """Whether every position in a world of width x height pixels fits binary frames."""
+    return max(width, height) <= MAX_BINARY_POSITION
+
+
+def _quantize(value) -> int:
+    # Clamped rather than wrapped; binary frames are only sent for worlds that fit (world_fits_binary)
+    return max(-0x8000, min(0x7FFF, round(value * POSITION_SCALE)))
+
+
+class BinaryFrameEncoder:
+    """
+    Same interface as FrameEncoder, but builds binary frames. Fauna records carry only what the client
+    draws (kind, position, stage, dead flag, age, offspring), with the kind and stage as numeric codes.
+    """
+
+    def __init__(self, tick: int):
+        self.tick = tick
+        self._entries = {}
+
+    def _entry(self, layout: str, entity_id, value=None) -> bytes:
+        key = (layout, entity_id, id(value))
+        entry = self._entries.get(key)
+        if entry is not None:
+            return entry
+        entry = _pack_str(entity_id)
+        if layout == "position":
+            entry += _POSITION.pack(_quantize(value["x"]), _quantize(value["y"]))
+        elif layout == "fauna":
+            entry += _FAUNA.pack(
+                FAUNA_KIND_CODES.get(value.get("kind"), UNKNOWN_CODE),
+                _quantize(value["x"]),
+                _quantize(value["y"]),
+                FAUNA_STAGE_CODES.get(value.get("stage"), UNKNOWN_CODE),
+                FLAG_DEAD if value.get("is_dead") else 0,
+                value.get("age_seconds") or 0,
+                min(value.get("offspring_count") or 0, 0xFFFF),
+            )
+        elif layout == "player":
+            entry += _POSITION.pack(_quantize(value["x"]), _quantize(value["y"])) + _pack_str(value.get("name", ""))
+        self._entries[key] = entry
+        return entry
+
+    def encode(self, sections: dict) -> bytes:
+        """sections maps a section name to {id: data} or [ids]; empty sections are skipped."""
+        parts = [_HEADER.pack(BINARY_FRAME_TICK_DELTA, BINARY_VERSION, self.tick)]
+        for name, content in sections.items():
+            if not content:
+                continue
+            code, layout = BINARY_SECTIONS[name]
+            if layout == "id":
+                entries = [self._entry(layout, entity_id) for entity_id in content]
+            else:
+                entries = [self._entry(layout, entity_id, value) for entity_id, value in content.items()]
+            for start in range(0, len(entries), _MAX_SECTION_ENTRIES):
+                run = entries[start:start + _MAX_SECTION_ENTRIES]
+                parts.append(_SECTION.pack(code, len(run)))
+                parts.extend(run)
+        return b"".join(parts)
+
+
+FRAME_ENCODERS = {ENCODING_JSON: FrameEncoder, ENCODING_BINARY: BinaryFrameEncoder}
+
+
+class FrameEncoders:
+    """One encoder per encoding for a tick, created on first use so their entry caches are shared."""
+
+    def __init__(self, tick: int):
+        self.tick = tick
+        self._encoders = {}
+
+    def encode(self, encoding: str, sections: dict):
+        encoder = self._encoders.get(encoding)
+        if encoder is None:
+            encoder = self._encoders[encoding] = FRAME_ENCODERS[encoding](self.tick)
+        with metrics.timer("encode", message_type="tick_delta", encoding=encoding):
+            return encoder.encode(sections)
@@ -0,0 +1,59 @@
+import time
+
+# --- Inbound Rate Limit Configuration ---
+# message type -> (tokens per second, burst). A client's messages of a type beyond its bucket are
+# rejected: actions get an error back, moves are just dropped (the next one carries the position).
+# These are the types a joined client sends; main counts any other type against the shared bucket
+# below and then drops it without answering.
+RATE_LIMITS = {
+    "player_move": (30.0, 30), # The client sends at most 10 a second
+    "player_chat": (2.0, 5),
+    "action_drop_food": (2.0, 5),
+    "action_till": (5.0, 10),
+}
+DEFAULT_RATE_LIMIT = (10.0, 20) # One bucket shared by every other message type
+OTHER_MESSAGES = "other" # Key of that shared bucket, and of its rejections
+MOVE_BROADCAST_RATE = 10.0 # player_moved broadcasts per second; moves in between are coalesced into the latest
+
+
+class TokenBucket:
+    """Holds up to burst tokens, refilled at rate per second. take() spends one if there is one."""
+
+    def __init__(self, rate: float, burst: int, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock()
+
+    def take(self) -> bool:
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class RateLimiter:
+    """One connection's token buckets, one per type in limits plus one shared by all other types, created as types show up."""
+
+    def __init__(self, limits: dict = None, default=DEFAULT_RATE_LIMIT):
+        self.limits = RATE_LIMITS if limits is None else limits
+        self.default = default
+        self.buckets = {}
+        # --- Metrics ---
+        self.rejected = {} # message type -> messages rejected
+
+    def allow(self, message_type: str) -> bool:
+        if message_type not in self.limits:
+            # Client-chosen types must not get buckets of their own: new ones would be fresh bursts, and unbounded
+            message_type = OTHER_MESSAGES
+        bucket = self.buckets.get(message_type)
+        if bucket is None:
+            bucket = self.buckets[message_type] = TokenBucket(*self.limits.get(message_type, self.default))
+        if bucket.take():
+            return True
+        self.rejected[message_type] = self.rejected.get(message_type, 0) + 1
+        return False
@@ -0,0 +1,177 @@
+import math
+
+# --- Spatial Index Configuration ---
+TILE_SIZE = 16
+DEFAULT_CELL_SIZE = TILE_SIZE * 4 # 64px cells: a 50x38 tile map is a 13x10 grid of cells
+
+
+class SpatialGrid:
+    """
+    Uniform grid over world pixel coordinates for point entities (food, fauna, players).
+
+    Inserts, moves and removes are O(1). Radius queries only visit the cells that overlap
+    the query circle, and nearest-neighbour searches walk outwards ring by ring until no
+    unvisited cell could hold anything closer. Ties go to the entity inserted first, which
+    is the same answer a linear scan over an insertion-ordered dict gives.
+    """
+
+    def __init__(self, cell_size: int = DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {} # (cx, cy) -> {entity_id: (x, y, seq)}
+        self.positions = {} # entity_id -> (x, y, (cx, cy), seq)
+        self._next_seq = 0
+        self._bounds = None # (min_cx, min_cy, max_cx, max_cy) of every cell ever used
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, entity_id):
+        return entity_id in self.positions
+
+    def _cell(self, x, y):
+        return (int(x // self.cell_size), int(y // self.cell_size))
+
+    # --- Updates ---
+    def insert(self, entity_id, x, y, _seq=None):
+        if entity_id in self.positions:
+            self.remove(entity_id)
+        if _seq is None:
+            _seq = self._next_seq
+            self._next_seq += 1
+        cell = self._cell(x, y)
+        self.cells.setdefault(cell, {})[entity_id] = (x, y, _seq)
+        self.positions[entity_id] = (x, y, cell, _seq)
+        if self._bounds is None:
+            self._bounds = (cell[0], cell[1], cell[0], cell[1])
+        else:
+            min_cx, min_cy, max_cx, max_cy = self._bounds
+            self._bounds = (min(min_cx, cell[0]), min(min_cy, cell[1]), max(max_cx, cell[0]), max(max_cy, cell[1]))
+
+    def move(self, entity_id, x, y):
+        old = self.positions.get(entity_id)
+        if old is None:
+            self.insert(entity_id, x, y)
+            return
+        cell = self._cell(x, y)
+        if old[2] == cell:
+            self.cells[cell][entity_id] = (x, y, old[3])
+            self.positions[entity_id] = (x, y, cell, old[3])
+        else:
+            self.insert(entity_id, x, y, _seq=old[3]) # Moving keeps the entity's place in the tie-break order
+
+    def remove(self, entity_id):
+        old = self.positions.pop(entity_id, None)
+        if old is None:
+            return
+        bucket = self.cells[old[2]]
+        del bucket[entity_id]
+        if not bucket:
+            del self.cells[old[2]]
+
+    def clear(self):
+        self.cells.clear()
+        self.positions.clear()
+        self._bounds = None
+
+    def get(self, entity_id):
+        """Returns the indexed (x, y) for an entity, or None."""
+        entry = self.positions.get(entity_id)
+        return (entry[0], entry[1]) if entry else None
+
+    # --- Queries ---
+    def query_rect(self, min_x, min_y, max_x, max_y):
+        """Yields (entity_id, x, y) for every entity inside the axis-aligned rectangle."""
+        min_cx, min_cy = self._cell(min_x, min_y)
+        max_cx, max_cy = self._cell(max_x, max_y)
+        if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) > len(self.cells):
+            candidates = self.cells.values()
+        else:
+            candidates = (self.cells[(cx, cy)] for cx in range(min_cx, max_cx + 1) for cy in range(min_cy, max_cy + 1) if (cx, cy) in self.cells)
+        for bucket in candidates:
+            for entity_id, (x, y, _) in bucket.items():
+                if min_x <= x <= max_x and min_y <= y <= max_y:
+                    yield entity_id, x, y
+
+    def query_radius(self, x, y, radius):
+        """Returns [(entity_id, ex, ey, distance)] for everything within radius of (x, y)."""
+        results = []
+        for entity_id, ex, ey in self.query_rect(x - radius, y - radius, x + radius, y + radius):
+            dist = math.hypot(x - ex, y - ey)
+            if dist <= radius:
+                results.append((entity_id, ex, ey, dist))
+        return results
+
+    def nearest(self, x, y, max_radius=None):
+        """Returns (entity_id, ex, ey, distance) for the closest entity, or None if there isn't one in range."""
+        if not self.positions:
+            return None
+        cx, cy = self._cell(x, y)
+        min_cx, min_cy, max_cx, max_cy = self._bounds
+        max_ring = max(cx - min_cx, max_cx - cx, cy - min_cy, max_cy - cy, 0)
+        best = None
+        best_dist = float('inf') if max_radius is None else max_radius
+        for ring in range(max_ring + 1):
+            # Scanning a ring costs more than scanning every occupied cell once it gets this wide
+            if (2 * ring + 1) ** 2 > 2 * len(self.cells):
+                best, best_dist = self._scan(self.cells.values(), x, y, best, best_dist)
+                break
+            best, best_dist = self._scan(self._ring(cx, cy, ring), x, y, best, best_dist)
+            # Anything in ring + 1 or beyond is at least ring * cell_size away (and might win a tie at exactly that)
+            if best is not None and best_dist < ring * self.cell_size:
+                break
+            if max_radius is not None and ring * self.cell_size > max_radius:
+                break
+        return (best[0], best[1], best[2], best_dist) if best else None
+
+    def _ring(self, cx, cy, ring):
+        if ring == 0:
+            bucket = self.cells.get((cx, cy))
+            if bucket:
+                yield bucket
+            return
+        for dx in range(-ring, ring + 1):
+            for cell in ((cx + dx, cy - ring), (cx + dx, cy + ring)):
+                bucket = self.cells.get(cell)
+                if bucket:
+                    yield bucket
+        for dy in range(-ring + 1, ring):
+            for cell in ((cx - ring, cy + dy), (cx + ring, cy + dy)):
+                bucket = self.cells.get(cell)
+                if bucket:
+                    yield bucket
+
+    def _scan(self, buckets, x, y, best, best_dist):
+        for bucket in buckets:
+            for entity_id, (ex, ey, seq) in bucket.items():
+                dist = math.hypot(x - ex, y - ey)
+                if dist < best_dist or (dist == best_dist and (best is None or seq < best[3])):
+                    best, best_dist = (entity_id, ex, ey, seq), dist
+        return best, best_dist
+
+
+# --- Invariant Checks ---
+def brute_force_nearest(points: dict, x, y):
+    """The original linear scan over {id: {"x", "y"}}; the reference the grid must agree with."""
+    best = None
+    for entity_id, pos in points.items():
+        dist = math.hypot(x - pos["x"], y - pos["y"])
+        if best is None or dist < best[3]:
+            best = (entity_id, pos["x"], pos["y"], dist)
+    return best
+
+
+def check_index(index: SpatialGrid, points: dict, x, y, radius=None):
+    """Raises AssertionError if the grid disagrees with a brute-force scan of points around (x, y)."""
+    if set(index.positions) != set(points):
+        raise AssertionError(f"Spatial index holds {len(index)} entities but the world has {len(points)}")
+    for entity_id, pos in points.items():
+        if index.get(entity_id) != (pos["x"], pos["y"]):
+            raise AssertionError(f"Spatial index has {entity_id} at {index.get(entity_id)}, world has ({pos['x']}, {pos['y']})")
+    expected, found = brute_force_nearest(points, x, y), index.nearest(x, y)
+    if expected != found:
+        raise AssertionError(f"Nearest to ({x}, {y}): grid found {found}, brute force found {expected}")
+    if radius is not None:
+        expected_ids = {eid for eid, pos in points.items() if math.hypot(x - pos["x"], y - pos["y"]) <= radius}
+        found_ids = {result[0] for result in index.query_radius(x, y, radius)}
+        if expected_ids != found_ids:
+            raise AssertionError(f"Radius {radius} around ({x}, {y}): grid found {len(found_ids)}, brute force found {len(expected_ids)}")
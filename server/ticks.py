@@ -0,0 +1,132 @@
+import time
+import asyncio
+from collections import deque
+
+# --- Tick Scheduler Configuration ---
+TICK_OVERRUN_POLICY = "skip" # "skip": drop missed ticks and realign, "catch_up": run missed ticks back to back
+TICK_OVERRUN_POLICIES = ("skip", "catch_up")
+MAX_CATCH_UP_TICKS = 3 # catch_up gives up and realigns once it is this many ticks behind
+TICK_METRICS_WINDOW = 100 # Ticks kept for the rolling timing stats
+
+
+class TickScheduler:
+    """
+    Fires ticks on absolute deadlines (start + n * period) so the period doesn't drift with load.
+
+    wait() sleeps until the next deadline and returns the real seconds since the previous tick,
+    which is what the simulation should advance by. When a tick runs past one or more deadlines,
+    "skip" drops the missed ticks and realigns to the next future deadline, while "catch_up" runs
+    them immediately (up to MAX_CATCH_UP_TICKS) before realigning.
+    """
+
+    def __init__(self, period: float, policy: str = TICK_OVERRUN_POLICY, max_catch_up: int = MAX_CATCH_UP_TICKS, clock=time.monotonic):
+        if policy not in TICK_OVERRUN_POLICIES:
+            raise ValueError(f"Unknown tick overrun policy '{policy}', expected one of {TICK_OVERRUN_POLICIES}")
+        self.period = period
+        self.policy = policy
+        self.max_catch_up = max_catch_up
+        self.clock = clock
+        self.tick = 0
+        self.next_deadline = None
+        self.last_tick_time = None
+        # --- Metrics ---
+        self.late_ticks = 0 # Ticks that started after their deadline had already passed
+        self.skipped_ticks = 0
+        self.caught_up_ticks = 0
+
+    async def wait(self) -> float:
+        now = self.clock()
+        if self.next_deadline is None:
+            self.last_tick_time = now
+            self.next_deadline = now + self.period
+        if now < self.next_deadline:
+            now = await self._sleep_until(self.next_deadline)
+        else:
+            self.late_ticks += 1
+            missed = int((now - self.next_deadline) // self.period) # Whole deadlines passed besides this one
+            if self.policy == "catch_up" and missed < self.max_catch_up:
+                self.caught_up_ticks += 1
+            elif missed:
+                # Realign: this tick runs now and stands in for the ones we missed
+                self.skipped_ticks += missed
+                self.next_deadline += missed * self.period
+        dt = now - self.last_tick_time
+        self.last_tick_time = now
+        self.next_deadline += self.period
+        self.tick += 1
+        return dt
+
+    async def _sleep_until(self, deadline: float) -> float:
+        delay = deadline - self.clock()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return self.clock()
+
+    def stats(self) -> dict:
+        return {
+            "tick": self.tick,
+            "period": self.period,
+            "policy": self.policy,
+            "late_ticks": self.late_ticks,
+            "skipped_ticks": self.skipped_ticks,
+            "caught_up_ticks": self.caught_up_ticks,
+        }
+
+
+class TickMetrics:
+    """Per-phase timings for the game loop over a rolling window of ticks, plus overrun counts."""
+
+    def __init__(self, period: float, window: int = TICK_METRICS_WINDOW):
+        self.period = period
+        self.phases = {} # phase name -> deque of durations in seconds
+        self.window = window
+        self.ticks = 0
+        self.overruns = 0 # Ticks whose total work took longer than the period
+        self.last_dt = None
+        self._current = None
+
+    def start_tick(self, dt: float):
+        self.last_dt = dt
+        self._current = {}
+
+    def phase(self, name: str):
+        """Context manager that times one phase of the current tick: `with metrics.phase("ai"): ...`"""
+        return _PhaseTimer(self, name)
+
+    def record(self, name: str, seconds: float):
+        self._current[name] = self._current.get(name, 0.0) + seconds
+
+    def end_tick(self):
+        total = sum(self._current.values())
+        self._current["total"] = total
+        for name, seconds in self._current.items():
+            self.phases.setdefault(name, deque(maxlen=self.window)).append(seconds)
+        self.ticks += 1
+        if total > self.period:
+            self.overruns += 1
+            print(f"Tick overran: {total:.3f}s of work for a {self.period}s period ({', '.join(f'{name} {seconds:.3f}s' for name, seconds in self._current.items())})")
+        self._current = None
+
+    def stats(self) -> dict:
+        phases = {}
+        for name, samples in self.phases.items():
+            phases[name] = {
+                "last_ms": round(samples[-1] * 1000, 3),
+                "avg_ms": round(sum(samples) / len(samples) * 1000, 3),
+                "max_ms": round(max(samples) * 1000, 3),
+            }
+        return {"ticks": self.ticks, "overruns": self.overruns, "last_dt": self.last_dt, "window": self.window, "phases": phases}
+
+
+class _PhaseTimer:
+    def __init__(self, metrics: TickMetrics, name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+        return False
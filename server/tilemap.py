@@ -0,0 +1,101 @@
+"""
+The zone's tile map: width * height tile bytes in one bytearray, row by row, the same layout
+zone_map stores in the database.
+
+Every change is recorded as a dirty rectangle (x, y, w, h) for each consumer that asked to track
+changes (the chunk cache, the persistence step in the game loop), so each of them only re-encodes
+or rewrites the regions that changed since it last looked.
+"""
+
+# --- Tile Map Configuration ---
+TILE_SIZE = 16 # Pixels per tile side
+MAX_DIRTY_RECTS = 64 # A consumer's pending rects collapse into their bounding box past this many
+
+
+class TileMap:
+    def __init__(self, width: int, height: int, tiles=None):
+        if tiles is not None and len(tiles) != width * height:
+            raise ValueError(f"Expected {width * height} tiles for a {width}x{height} map, got {len(tiles)}")
+        self.width = width
+        self.height = height
+        self.tiles = bytearray(tiles) if tiles is not None else bytearray(width * height)
+        self._dirty = {} # consumer name -> [(x, y, w, h)] changed since it last called take_dirty
+
+    def in_bounds(self, x: int, y: int) -> bool:
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def get(self, x: int, y: int) -> int:
+        return self.tiles[y * self.width + x]
+
+    def set(self, x: int, y: int, tile_type: int) -> bool:
+        """Sets one tile; returns False (and marks nothing dirty) if it already had that type."""
+        offset = y * self.width + x
+        if self.tiles[offset] == tile_type:
+            return False
+        self.tiles[offset] = tile_type
+        self._mark_dirty((x, y, 1, 1))
+        return True
+
+    def fill(self, tile_type: int, x: int = 0, y: int = 0, w: int = None, h: int = None):
+        """Sets every tile in a rectangle, the whole map by default. The rectangle has to lie inside the map."""
+        w = self.width - x if w is None else w
+        h = self.height - y if h is None else h
+        if x < 0 or y < 0 or w < 0 or h < 0 or x + w > self.width or y + h > self.height:
+            raise ValueError(f"Rectangle ({x}, {y}, {w}, {h}) is outside the {self.width}x{self.height} map")
+        row = bytes([tile_type]) * w
+        for ty in range(y, y + h):
+            offset = ty * self.width + x
+            self.tiles[offset:offset + w] = row
+        self._mark_dirty((x, y, w, h))
+
+    # --- Zero-copy views for serialization ---
+    def view(self) -> memoryview:
+        return memoryview(self.tiles)
+
+    def row(self, y: int) -> memoryview:
+        return memoryview(self.tiles)[y * self.width:(y + 1) * self.width]
+
+    def region(self, x: int, y: int, w: int, h: int) -> bytes:
+        """The tiles of a rectangle as w * h bytes, row by row."""
+        if x == 0 and w == self.width:
+            return bytes(self.tiles[y * self.width:(y + h) * self.width])
+        return b"".join(self.row(ty)[x:x + w] for ty in range(y, y + h))
+
+    def to_rows(self) -> list:
+        """The map as a list of rows of ints: what world_state messages have always carried."""
+        return [list(self.row(y)) for y in range(self.height)]
+
+    # --- Dirty regions ---
+    def track(self, consumer: str):
+        """Starts recording dirty rects for a consumer; everything counts as changed at first."""
+        self._dirty[consumer] = [(0, 0, self.width, self.height)]
+
+    def take_dirty(self, consumer: str) -> list:
+        """Returns the rects changed since the consumer last called this, and forgets them."""
+        rects = self._dirty[consumer]
+        self._dirty[consumer] = []
+        return rects
+
+    def _mark_dirty(self, rect):
+        x, y, w, h = rect
+        for consumer, rects in self._dirty.items():
+            if any(rx <= x and ry <= y and x + w <= rx + rw and y + h <= ry + rh for rx, ry, rw, rh in rects):
+                continue
+            rects.append(rect)
+            if len(rects) > MAX_DIRTY_RECTS:
+                self._dirty[consumer] = [_bounding_box(rects)]
+
+
+def _bounding_box(rects):
+    x0 = min(x for x, _, _, _ in rects)
+    y0 = min(y for _, y, _, _ in rects)
+    x1 = max(x + w for x, _, w, _ in rects)
+    y1 = max(y + h for _, y, _, h in rects)
+    return (x0, y0, x1 - x0, y1 - y0)
+
+
+def encode_world(value):
+    """json.dumps default= hook so world_state, whose "map" is a TileMap, serializes as before."""
+    if isinstance(value, TileMap):
+        return value.to_rows()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
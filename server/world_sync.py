@@ -0,0 +1,116 @@
+"""
+Chunked world sync for joins and zone resets.
+
+Instead of one "world_state" message holding the whole map and every entity, a client that asks
+for sync "chunked" gets a stream:
+
+    world_begin     map size, chunk size and how many chunks/entities follow
+    map_chunk       one run-length encoded block of tiles (cached until a tile in it changes)
+    world_entities  one page of fauna, food or players
+    world_end       the client can build the world now
+
+The connection manager holds back every other message for the client until world_end is queued.
+"""
+
+from tilemap import TileMap
+from instrumentation import encode_message
+
+# --- Chunked Sync Configuration ---
+SYNC_FULL = "full" # The original single world_state message
+SYNC_CHUNKED = "chunked"
+SYNC_MODES = (SYNC_FULL, SYNC_CHUNKED)
+MAP_CHUNK_SIZE = 16 # Tiles per chunk side: a 50x38 map is 4x3 chunks
+ENTITY_PAGE_SIZE = 200 # Entities per world_entities message
+DIRTY_CONSUMER = "map_chunks" # Name the chunk cache tracks tile changes under (see TileMap.track)
+
+
+def negotiate_sync(requested) -> str:
+    """Picks the initial sync mode for a client from its join request."""
+    return requested if requested in SYNC_MODES else SYNC_FULL
+
+
+def encode_runs(tiles) -> list:
+    """Run-length encodes flat tiles (a list or bytes) as [value, count, value, count, ...]."""
+    runs = []
+    for tile in tiles:
+        if runs and runs[-2] == tile:
+            runs[-1] += 1
+        else:
+            runs.extend((tile, 1))
+    return runs
+
+
+class MapChunkCache:
+    """Serialized map_chunk messages, re-encoded only after a tile inside them changes."""
+
+    def __init__(self, tile_map: TileMap, chunk_size: int = MAP_CHUNK_SIZE):
+        self.tile_map = tile_map
+        self.chunk_size = chunk_size
+        self._chunks = {} # (cx, cy) -> map_chunk JSON
+        tile_map.track(DIRTY_CONSUMER)
+        # --- Metrics ---
+        self.hits = 0
+        self.encodes = 0
+
+    @property
+    def height(self) -> int:
+        return self.tile_map.height
+
+    @property
+    def width(self) -> int:
+        return self.tile_map.width
+
+    def chunk_coords(self):
+        for cy in range(0, self.height, self.chunk_size):
+            for cx in range(0, self.width, self.chunk_size):
+                yield cx // self.chunk_size, cy // self.chunk_size
+
+    def invalidate(self, x: int, y: int, w: int = 1, h: int = 1):
+        """Drops every cached chunk overlapping the w x h tiles at (x, y)."""
+        if w >= self.width and h >= self.height:
+            self._chunks.clear()
+            return
+        for cy in range(y // self.chunk_size, (y + h - 1) // self.chunk_size + 1):
+            for cx in range(x // self.chunk_size, (x + w - 1) // self.chunk_size + 1):
+                self._chunks.pop((cx, cy), None)
+
+    def chunk(self, cx: int, cy: int) -> str:
+        for rect in self.tile_map.take_dirty(DIRTY_CONSUMER):
+            self.invalidate(*rect)
+        message = self._chunks.get((cx, cy))
+        if message is not None:
+            self.hits += 1
+            return message
+        x0, y0 = cx * self.chunk_size, cy * self.chunk_size
+        w, h = min(self.chunk_size, self.width - x0), min(self.chunk_size, self.height - y0)
+        message = encode_message({"type": "map_chunk", "x": x0, "y": y0, "w": w, "h": h, "rle": encode_runs(self.tile_map.region(x0, y0, w, h))})
+        self._chunks[(cx, cy)] = message
+        self.encodes += 1
+        return message
+
+    def stats(self) -> dict:
+        return {"cached_chunks": len(self._chunks), "hits": self.hits, "encodes": self.encodes}
+
+
+def sync_messages(map_chunks: MapChunkCache, entities: dict, player_id=None, reason: str = "join", page_size: int = ENTITY_PAGE_SIZE):
+    """
+    Yields the chunked sync stream for one client. entities maps a kind to [(id, data)] and should be
+    a snapshot: pages are encoded lazily, between sends, so the live dicts may have moved on by then.
+    """
+    begin = {
+        "type": "world_begin",
+        "reason": reason,
+        "width": map_chunks.width,
+        "height": map_chunks.height,
+        "chunk_size": map_chunks.chunk_size,
+        "entities": {kind: len(items) for kind, items in entities.items()},
+    }
+    if player_id is not None:
+        begin["player_id"] = player_id
+    yield encode_message(begin)
+    for cx, cy in map_chunks.chunk_coords():
+        yield map_chunks.chunk(cx, cy)
+    for kind, items in entities.items():
+        for start in range(0, len(items), page_size):
+            yield encode_message({"type": "world_entities", "kind": kind, "entities": dict(items[start:start + page_size])})
+    yield encode_message({"type": "world_end", "reason": reason})
@@ -0,0 +1,177 @@
+"""
+Zone worker processes for the sharded server (see gateway.py).
+
+Each zone is a full copy of main.py's game (its own world_state, fauna engine, game loop and
+database file) running in its own process, so every zone gets its own core. The gateway owns the
+real websockets; a zone only sees RemoteSockets whose frames travel over multiprocessing queues:
+
+    gateway -> zone   ("open", session) / ("recv", session, text) / ("close", session) / ("stop",)
+    zone -> gateway   ("send", session, text or bytes) / ("close", session, code)
+"""
+
+import asyncio
+import threading
+import multiprocessing
+from fastapi import WebSocketDisconnect
+
+# --- Zone Sharding Configuration ---
+ZONE_COLUMNS = 2
+ZONE_ROWS = 1
+ZONE_WIDTH = 50 * 16 # Pixels; every zone has the default 50x38 tile map
+ZONE_HEIGHT = 38 * 16
+ZONE_DB_FILE = "project_arbor_zone_{zone_id}.db"
+ZONE_STOP_TIMEOUT = 5.0 # Seconds a stopping zone waits for its players' disconnect handlers
+
+_DISCONNECT = object()
+
+
+def zone_id(zx: int, zy: int) -> str:
+    return f"{zx}_{zy}"
+
+
+def zone_coords(zone: str):
+    zx, zy = zone.split("_")
+    return int(zx), int(zy)
+
+
+def all_zone_ids() -> list:
+    return [zone_id(zx, zy) for zy in range(ZONE_ROWS) for zx in range(ZONE_COLUMNS)]
+
+
+def handoff_target(zone: str, x, y):
+    """
+    If (x, y) in zone's local coordinates lies past one of its edges and there is a zone on the
+    other side, returns (neighbour zone, x, y in the neighbour's coordinates). Otherwise None.
+    """
+    zx, zy = zone_coords(zone)
+    if x < 0 and zx > 0:
+        zx, x = zx - 1, x + ZONE_WIDTH
+    elif x >= ZONE_WIDTH and zx < ZONE_COLUMNS - 1:
+        zx, x = zx + 1, x - ZONE_WIDTH
+    if y < 0 and zy > 0:
+        zy, y = zy - 1, y + ZONE_HEIGHT
+    elif y >= ZONE_HEIGHT and zy < ZONE_ROWS - 1:
+        zy, y = zy + 1, y - ZONE_HEIGHT
+    target = zone_id(zx, zy)
+    return None if target == zone else (target, x, y)
+
+
+class RemoteSocket:
+    """Stands in for a FastAPI WebSocket inside a zone; its frames go through the gateway."""
+
+    def __init__(self, session: str, outbox):
+        self.session = session
+        self.outbox = outbox
+        self.incoming = asyncio.Queue()
+        self.closed = False
+
+    async def accept(self):
+        pass
+
+    async def receive_text(self) -> str:
+        message = await self.incoming.get()
+        if message is _DISCONNECT:
+            self.incoming.put_nowait(_DISCONNECT) # Any later receive fails the same way
+            raise WebSocketDisconnect(1000)
+        return message
+
+    async def send_text(self, data: str):
+        if not self.closed:
+            self.outbox.put(("send", self.session, data))
+
+    async def send_bytes(self, data: bytes):
+        if not self.closed:
+            self.outbox.put(("send", self.session, data))
+
+    async def close(self, code: int = 1000):
+        if not self.closed:
+            self.closed = True
+            self.outbox.put(("close", self.session, code))
+
+    def disconnected(self):
+        self.closed = True
+        self.incoming.put_nowait(_DISCONNECT)
+
+
+class ZoneProcess:
+    """The gateway's handle on one zone worker: the process and the queue that feeds it."""
+
+    def __init__(self, zone: str, context, outbox):
+        self.zone = zone
+        self.inbox = context.Queue()
+        self.process = context.Process(target=run_zone, args=(zone, self.inbox, outbox), name=f"zone-{zone}", daemon=True)
+
+    def start(self):
+        self.process.start()
+
+    def send(self, *message):
+        self.inbox.put(message)
+
+    def stop(self):
+        if self.process.is_alive():
+            self.send("stop")
+            self.process.join(ZONE_STOP_TIMEOUT + 1)
+
+    def stats(self) -> dict:
+        return {"alive": self.process.is_alive(), "pid": self.process.pid}
+
+
+def start_zones(outbox, context=None) -> dict:
+    """Spawns one worker per zone. Spawned (not forked) so no event loop state leaks into them."""
+    context = context or multiprocessing.get_context("spawn")
+    zones = {zone: ZoneProcess(zone, context, outbox) for zone in all_zone_ids()}
+    for process in zones.values():
+        process.start()
+    return zones
+
+
+def pump(queue, loop, target: asyncio.Queue):
+    """Thread body: moves items from a multiprocessing queue onto an asyncio queue."""
+    while True:
+        item = queue.get()
+        loop.call_soon_threadsafe(target.put_nowait, item)
+        if item == ("stop",):
+            return
+
+
+# --- Zone Worker ---
+def run_zone(zone: str, inbox, outbox):
+    """Process entry point: loads this zone's world from its own database and serves it."""
+    import db
+    db.DB_FILE = ZONE_DB_FILE.format(zone_id=zone)
+    import main
+    main.ZONE_ID = zone
+    asyncio.run(_serve_zone(main, zone, inbox, outbox))
+
+
+async def _serve_zone(main, zone: str, inbox, outbox):
+    incoming = asyncio.Queue()
+    threading.Thread(target=pump, args=(inbox, asyncio.get_running_loop(), incoming), name=f"zone-{zone}-bus", daemon=True).start()
+    await main.startup_event_full()
+    print(f"Zone {zone} is running (pid {multiprocessing.current_process().pid})")
+    sockets, players = {}, {}
+    while True:
+        message = await incoming.get()
+        op = message[0]
+        if op == "open":
+            session = message[1]
+            socket = sockets[session] = RemoteSocket(session, outbox)
+            task = players[session] = asyncio.create_task(main.websocket_endpoint(socket))
+            task.add_done_callback(lambda _, session=session: (sockets.pop(session, None), players.pop(session, None)))
+        elif op == "recv":
+            socket = sockets.get(message[1])
+            if socket is not None:
+                socket.incoming.put_nowait(message[2])
+        elif op == "close":
+            socket = sockets.get(message[1])
+            if socket is not None:
+                socket.disconnected()
+        elif op == "stop":
+            break
+    # Let every player's disconnect handler save their position before the store closes
+    for socket in list(sockets.values()):
+        socket.disconnected()
+    if players:
+        await asyncio.wait(list(players.values()), timeout=ZONE_STOP_TIMEOUT)
+    await main.shutdown_event()
+    print(f"Zone {zone} stopped")